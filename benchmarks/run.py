@@ -0,0 +1,249 @@
+"""
+Offline benchmarks of covidmx.
+
+Generates synthetic DGE data, serves it from a local stand-in of the
+DGE and Serendipia hosts and times the download, read, clean, cache,
+aggregate, series and plot stages. Peak memory of each stage is tracked with
+tracemalloc (memory allocated by python and numpy/pandas buffers).
+
+Usage
+-----
+    python benchmarks/run.py --rows 1000000 5000000 --output results.json
+    python benchmarks/run.py --rows 1000000 --compare results.json
+
+Fixtures are generated once per row count inside --fixtures and reused.
+Import times are measured first, each in a fresh interpreter.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+
+import covidmx.dge as dge
+from covidmx import CovidMX
+from covidmx.cube import DGECube
+from covidmx.dge_plot import DGEPlot
+from covidmx.geometry import GeoCache
+from covidmx.series import EpiCurves
+from covidmx.utils import download_file, read_table, write_table
+
+from server import stand_in
+from synthetic import write_fixtures
+
+IMPORTS = {
+    'import': 'covidmx',
+    'import_dge': 'covidmx.dge',
+    'import_plot': 'covidmx.dge_plot'
+}
+IMPORT_SCRIPT = """
+import time, tracemalloc
+if {trace}:
+    tracemalloc.start()
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, tracemalloc.get_traced_memory()[1])
+"""
+HISTORICAL_DATES = ['2020-05-30', '2020-05-31']
+SERENDIPIA_DATES = ['2020-05-29', '2020-05-30', '2020-05-31']
+PRESERVE_ORIGINAL = ['MUNICIPIO_RES', 'ENTIDAD_RES']
+
+
+def measure(results, stage, n_rows, func, *args, **kwargs):
+    """
+    Runs func and appends its wall time and peak traced memory
+    to results. Returns the output of func.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        output = func(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    results.append({
+        'stage': stage,
+        'rows': n_rows,
+        'seconds': round(seconds, 4),
+        'peak_mb': round(peak / 1024 ** 2, 2)
+    })
+    print('{:>10} rows  {:<22} {:>9.2f}s {:>10.1f} MB'.format(n_rows, stage, seconds, peak / 1024 ** 2))
+
+    return output
+
+
+def measure_imports(results, repeat=3):
+    """
+    Appends the import time (best of repeat runs) and peak traced memory
+    of each module in IMPORTS, measured in fresh interpreters. Time is
+    measured without tracemalloc, which slows imports down.
+    """
+    def import_module(module, trace):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module, trace=trace)],
+                                check=True, capture_output=True, text=True).stdout
+        seconds, peak = output.split()
+        return float(seconds), int(peak)
+
+    for stage, module in IMPORTS.items():
+        seconds = min(import_module(module, False)[0] for _ in range(repeat))
+        peak = import_module(module, True)[1]
+
+        results.append({
+            'stage': stage,
+            'rows': 0,
+            'seconds': round(seconds, 4),
+            'peak_mb': round(peak / 1024 ** 2, 2)
+        })
+        print('{:>10} rows  {:<22} {:>9.2f}s {:>10.1f} MB'.format(0, stage, seconds, peak / 1024 ** 2))
+
+
+def run(n_rows, fixtures, work_dir, plot=True, historical=True, n_jobs=None):
+    """
+    Returns the results of every stage for a publication of n_rows.
+    """
+    results = []
+    fixtures = os.path.join(fixtures, str(n_rows))
+    write_fixtures(fixtures, n_rows,
+                   historical_dates=HISTORICAL_DATES if historical else (),
+                   serendipia_dates=SERENDIPIA_DATES)
+
+    data_path = os.path.join(work_dir, str(n_rows))
+    shutil.rmtree(data_path, ignore_errors=True)
+
+    with stand_in(fixtures):
+        measure(results, 'download', n_rows, download_file, data_path, dge.URL_DATA)
+        measure(results, 'download_conditional', n_rows, download_file, data_path, dge.URL_DATA)
+        measure(results, 'download_segments', n_rows, download_file,
+                os.path.join(data_path, 'segments'), dge.URL_DATA, segments=4)
+
+        dge_source = CovidMX(data_path=data_path)
+        catalogo, descripcion = measure(results, 'dictionary', n_rows, dge_source.read_dictionary)
+        measure(results, 'dictionary_cached', n_rows, CovidMX(data_path=data_path).read_dictionary)
+
+        measure(results, 'read_pyarrow', n_rows,
+                CovidMX(data_path=data_path, clean=False, parser='pyarrow').get_data)
+        raw = measure(results, 'read', n_rows, CovidMX(data_path=data_path, clean=False).get_data)
+        # clean_data decodes its input in place
+        measure(results, 'clean_parallel', n_rows, CovidMX(data_path=data_path, n_jobs=n_jobs).clean_data,
+                raw.copy(), catalogo, descripcion, PRESERVE_ORIGINAL)
+        clean = measure(results, 'clean', n_rows, dge_source.clean_data,
+                        raw, catalogo, descripcion, PRESERVE_ORIGINAL)
+        del raw
+
+        clean_file = dge_source.get_clean_data_file()
+        measure(results, 'cache_write', n_rows, write_table, clean, clean_file, dge_source.cache_format)
+        del clean
+        clean = measure(results, 'cache_read', n_rows, read_table, clean_file, dge_source.cache_format)
+        measure(results, 'cache_select', n_rows, dge_source.get_data,
+                columns=['id_registro', 'municipio_res', 'fecha_sintomas', 'resultado'],
+                filters=[('entidad_res', '==', 'JALISCO')])
+
+        cube = measure(results, 'aggregate', n_rows, DGECube.from_data, clean)
+        curves = measure(results, 'series', n_rows, EpiCurves.from_data, clean)
+        measure(results, 'series_update', n_rows, EpiCurves.from_data, clean, previous=curves)
+        del clean
+
+        streaming = CovidMX(data_path=os.path.join(data_path, 'streaming'), memory_budget=256 * 1024 ** 2)
+        measure(results, 'read_clean_streaming', n_rows, streaming.get_data,
+                preserve_original=PRESERVE_ORIGINAL)
+
+        if plot:
+            geo_cache = GeoCache(os.path.join(data_path, 'geo'))
+            dge_plot = measure(results, 'plot_setup', n_rows, DGEPlot,
+                               None, catalogo, descripcion, cube=cube, geo_cache=geo_cache)
+            measure(results, 'plot_national', n_rows, dge_plot.plot_map, status='confirmados',
+                    add_municipalities=True, save_file_name=os.path.join(data_path, 'national.png'))
+            measure(results, 'plot_state', n_rows, dge_plot.plot_map, status='confirmados',
+                    state='CIUDAD DE MÉXICO', add_municipalities=True,
+                    save_file_name=os.path.join(data_path, 'state.png'))
+
+        if historical:
+            measure(results, 'historical', n_rows, CovidMX(data_path=data_path).get_historical_data,
+                    HISTORICAL_DATES[0], HISTORICAL_DATES[-1], date_format='%Y-%m-%d', n_jobs=n_jobs)
+
+        serendipia_path = os.path.join(data_path, 'serendipia')
+        measure(results, 'serendipia', n_rows,
+                CovidMX(source='Serendipia', date=SERENDIPIA_DATES[-1], date_format='%Y-%m-%d',
+                        data_path=serendipia_path).get_data)
+        for stage in ['serendipia_range', 'serendipia_range_cached']:
+            measure(results, stage, n_rows,
+                    CovidMX(source='Serendipia', start_date=SERENDIPIA_DATES[0],
+                            end_date=SERENDIPIA_DATES[-1], date_format='%Y-%m-%d',
+                            data_path=os.path.join(data_path, 'serendipia_range')).get_data)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the stages of results slower than baseline
+    by more than tolerance (fraction).
+    """
+    baseline = {(row['stage'], row['rows']): row for row in baseline}
+    regressions = []
+    for row in results:
+        previous = baseline.get((row['stage'], row['rows']))
+        if previous is None:
+            continue
+        for metric in ['seconds', 'peak_mb']:
+            if row[metric] > previous[metric] * (1 + tolerance) and row[metric] - previous[metric] > 0.05:
+                regressions.append({**row, 'metric': metric, 'baseline': previous[metric]})
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks of covidmx.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000],
+                        help='Rows of the synthetic publications.')
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), 'covidmx-benchmarks'),
+                        help='Directory of the synthetic files, reused between runs.')
+    parser.add_argument('--output', help='Write results to this json file.')
+    parser.add_argument('--compare', help='Json file of a previous run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed relative slowdown before reporting a regression.')
+    parser.add_argument('--n-jobs', type=int, default=None,
+                        help='Processes used by the historical and parallel clean benchmarks.')
+    parser.add_argument('--skip-plot', action='store_true')
+    parser.add_argument('--skip-historical', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+
+    results = []
+    measure_imports(results)
+    with tempfile.TemporaryDirectory() as work_dir:
+        for n_rows in args.rows:
+            results += run(n_rows, args.fixtures, work_dir,
+                           plot=not args.skip_plot,
+                           historical=not args.skip_historical,
+                           n_jobs=args.n_jobs)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for row in regressions:
+            print('Regression in {stage} ({rows} rows): {metric} {baseline} -> {value}'.format(
+                value=row[row['metric']], **row))
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
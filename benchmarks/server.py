@@ -0,0 +1,145 @@
+"""
+Local HTTP server standing in for the DGE and Serendipia hosts.
+
+Files are served from a directory written by synthetic.write_fixtures,
+with ETag/Last-Modified validation and Range requests like the
+real servers, so downloads exercise the same code paths offline.
+"""
+import contextlib
+import email.utils
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import covidmx.dge as dge
+import covidmx.serendipia as serendipia
+
+from synthetic import DATA_FILE, DICTIONARY_FILE, HISTORICAL_FILE, SERENDIPIA_DIR
+
+
+def validators(path):
+    """
+    Returns the ETag and Last-Modified headers served for path.
+    """
+    stat = os.stat(path)
+
+    return '"{:x}-{:x}"'.format(stat.st_size, int(stat.st_mtime)), \
+        email.utils.formatdate(stat.st_mtime, usegmt=True)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves files inside directory with conditional and range requests.
+    Headers of every request are appended to requests_log.
+    """
+    directory = '.'
+    requests_log = None
+
+    def do_HEAD(self):
+        self.serve(body=False)
+
+    def do_GET(self):
+        self.serve(body=True)
+
+    def serve(self, body=True):
+        self.requests_log.append(dict(self.headers))
+        path = os.path.join(self.directory, self.path.split('?')[0].lstrip('/'))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        stat = os.stat(path)
+        etag, last_modified = validators(path)
+
+        if self.headers.get('If-None-Match') == etag or \
+                self.headers.get('If-Modified-Since') == last_modified:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        start, end = 0, stat.st_size - 1
+        range_header = self.headers.get('Range')
+        partial = range_header is not None and \
+            self.headers.get('If-Range', etag) in (etag, last_modified)
+        if partial:
+            start, end = range_header.replace('bytes=', '').split('-')
+            start, end = int(start), min(int(end or stat.st_size - 1), stat.st_size - 1)
+            if start >= stat.st_size:
+                self.send_error(416)
+                return
+
+        self.send_response(206 if partial else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if partial:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, stat.st_size))
+        self.end_headers()
+
+        if body:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    block = f.read(min(remaining, 1024 * 1024))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    remaining -= len(block)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve(directory):
+    """
+    Serves directory on a local port while the context is active.
+    Yields the base url and the list of headers of every request.
+    """
+    handler = type('Handler', (StandInHandler,), {'directory': str(directory), 'requests_log': []})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield 'http://127.0.0.1:{}/'.format(httpd.server_port), handler.requests_log
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@contextlib.contextmanager
+def stand_in(directory):
+    """
+    Serves directory on a local port and points covidmx URLs
+    (URL_DATA, URL_DESCRIPTION, URL_HISTORICAL and URL_SERENDIPIA)
+    to it while the context is active. Yields the base url.
+    """
+    with serve(directory) as (base, _):
+        with point_urls(base):
+            yield base
+
+
+@contextlib.contextmanager
+def point_urls(base):
+    """
+    Points covidmx URLs to the files served at base.
+    """
+    urls = {
+        (dge, 'URL_DATA'): base + DATA_FILE,
+        (dge, 'URL_DESCRIPTION'): base + DICTIONARY_FILE,
+        (dge, 'URL_HISTORICAL'): base + HISTORICAL_FILE,
+        (serendipia, 'URL_SERENDIPIA'): base + SERENDIPIA_DIR
+    }
+    original = {key: getattr(*key) for key in urls}
+    for (module, name), url in urls.items():
+        setattr(module, name, url)
+
+    try:
+        yield base
+    finally:
+        for (module, name), url in original.items():
+            setattr(module, name, url)
+
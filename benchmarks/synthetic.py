@@ -0,0 +1,235 @@
+"""
+Synthetic DGE and Serendipia files shaped like the published ones.
+
+Data archives are written in chunks, so files of tens of millions
+of rows can be generated with bounded memory.
+"""
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 1000000
+N_MUNICIPALITIES = 60
+
+SI_NO = {1: 'SI', 2: 'NO', 97: 'NO APLICA', 98: 'SE IGNORA', 99: 'NO ESPECIFICADO'}
+CATALOGUES = {
+    'Catálogo ORIGEN': {1: 'USMER', 2: 'FUERA DE USMER', 99: 'NO ESPECIFICADO'},
+    'Catálogo SECTOR': {i: 'SECTOR {}'.format(i) for i in range(1, 14)},
+    'Catálogo SEXO': {1: 'MUJER', 2: 'HOMBRE', 99: 'NO ESPECIFICADO'},
+    'Catálogo TIPO_PACIENTE': {1: 'AMBULATORIO', 2: 'HOSPITALIZADO', 99: 'NO ESPECIFICADO'},
+    'Catálogo SI_NO': SI_NO,
+    'Catálogo NACIONALIDAD': {1: 'MEXICANA', 2: 'EXTRANJERA', 99: 'NO ESPECIFICADO'},
+    'Catálogo RESULTADO': {1: 'Positivo SARS-CoV-2', 2: 'No positivo SARS-CoV-2', 3: 'Resultado pendiente'},
+}
+STATES = {
+    1: 'AGUASCALIENTES', 2: 'BAJA CALIFORNIA', 3: 'BAJA CALIFORNIA SUR', 4: 'CAMPECHE',
+    5: 'COAHUILA DE ZARAGOZA', 6: 'COLIMA', 7: 'CHIAPAS', 8: 'CHIHUAHUA',
+    9: 'CIUDAD DE MÉXICO', 10: 'DURANGO', 11: 'GUANAJUATO', 12: 'GUERRERO',
+    13: 'HIDALGO', 14: 'JALISCO', 15: 'MÉXICO', 16: 'MICHOACÁN DE OCAMPO',
+    17: 'MORELOS', 18: 'NAYARIT', 19: 'NUEVO LEÓN', 20: 'OAXACA', 21: 'PUEBLA',
+    22: 'QUERÉTARO', 23: 'QUINTANA ROO', 24: 'SAN LUIS POTOSÍ', 25: 'SINALOA',
+    26: 'SONORA', 27: 'TABASCO', 28: 'TAMAULIPAS', 29: 'TLAXCALA',
+    30: 'VERACRUZ DE IGNACIO DE LA LLAVE', 31: 'YUCATÁN', 32: 'ZACATECAS',
+    36: 'ESTADOS UNIDOS MEXICANOS', 97: 'NO APLICA', 98: 'SE IGNORA', 99: 'NO ESPECIFICADO'
+}
+
+DESCRIPTION = [
+    ('FECHA_ACTUALIZACION', 'AAAA-MM-DD'),
+    ('ID_REGISTRO', 'TEXTO, 99 = SE IGNORA'),
+    ('ORIGEN', 'CATÁLOGO: ORIGEN'),
+    ('SECTOR', 'CATÁLOGO: SECTOR'),
+    ('ENTIDAD_UM', 'CATALÓGO: ENTIDADES'),
+    ('SEXO', 'CATÁLOGO: SEXO'),
+    ('ENTIDAD_NAC', 'CATALÓGO: ENTIDADES'),
+    ('ENTIDAD_RES', 'CATALÓGO: ENTIDADES'),
+    ('MUNICIPIO_RES', 'CATALÓGO: MUNICIPIOS'),
+    ('TIPO_PACIENTE', 'CATÁLOGO: TIPO_PACIENTE'),
+    ('FECHA_INGRESO', 'AAAA-MM-DD'),
+    ('FECHA_SINTOMAS', 'AAAA-MM-DD'),
+    ('FECHA_DEF', 'AAAA-MM-DD'),
+    ('INTUBADO', 'CATÁLOGO: SI_NO'),
+    ('NEUMONIA', 'CATÁLOGO: SI_NO'),
+    ('EDAD', 'NÚMERICA EN AÑOS'),
+    ('NACIONALIDAD', 'CATÁLOGO: NACIONALIDAD'),
+    ('EMBARAZO', 'CATÁLOGO: SI_NO'),
+    ('HABLA_LENGUA_INDIG', 'CATÁLOGO: SI_NO'),
+    ('DIABETES', 'CATÁLOGO: SI_NO'),
+    ('EPOC', 'CATÁLOGO: SI_NO'),
+    ('ASMA', 'CATÁLOGO: SI_NO'),
+    ('INMUSUPR', 'CATÁLOGO: SI_NO'),
+    ('HIPERTENSION', 'CATÁLOGO: SI_NO'),
+    ('OTRAS_COM', 'CATÁLOGO: SI_NO'),
+    ('CARDIOVASCULAR', 'CATÁLOGO: SI_NO'),
+    ('OBESIDAD', 'CATÁLOGO: SI_NO'),
+    ('RENAL_CRONICA', 'CATÁLOGO: SI_NO'),
+    ('TABAQUISMO', 'CATÁLOGO: SI_NO'),
+    ('OTRO_CASO', 'CATÁLOGO: SI_NO'),
+    ('RESULTADO', 'CATÁLOGO: RESULTADO'),
+    ('MIGRANTE', 'CATÁLOGO: SI_NO'),
+    ('PAIS_NACIONALIDAD', 'TEXTO, 99= SE IGNORA'),
+    ('PAIS_ORIGEN', 'TEXTO, 97= NO APLICA'),
+    ('UCI', 'CATÁLOGO: SI_NO'),
+]
+SI_NO_COLS = [name if name != 'OTRAS_COM' else 'OTRA_COM' \
+              for name, formato in DESCRIPTION if formato == 'CATÁLOGO: SI_NO']
+
+DATA_FILE = 'datos_abiertos_covid19.zip'
+DICTIONARY_FILE = 'diccionario_datos_covid19.zip'
+HISTORICAL_FILE = 'historicos/datos_abiertos_covid19_{}.zip'
+SERENDIPIA_DIR = 'serendipia/{}/{}/'
+
+
+def make_chunk(n_rows, start=0, seed=0, date='2020-06-01'):
+    """
+    Returns n_rows DGE records with ids starting at start.
+    """
+    rng = np.random.RandomState(seed)
+    update = pd.Timestamp(date)
+    first = np.datetime64('2020-01-15')
+    n_days = max((update - pd.Timestamp(first)).days - 7, 1)
+
+    symptoms = first + rng.randint(0, n_days, n_rows).astype('timedelta64[D]')
+    admission = symptoms + rng.randint(0, 7, n_rows).astype('timedelta64[D]')
+    death = admission + rng.randint(0, 20, n_rows).astype('timedelta64[D]')
+    dead = rng.rand(n_rows) < 0.08
+
+    df = pd.DataFrame({
+        'FECHA_ACTUALIZACION': update.strftime('%Y-%m-%d'),
+        'ID_REGISTRO': pd.Series(np.arange(start, start + n_rows)).map('{:07x}'.format).to_numpy(),
+        'ORIGEN': rng.choice([1, 2], n_rows),
+        'SECTOR': rng.randint(1, 14, n_rows),
+        'ENTIDAD_UM': rng.randint(1, 33, n_rows),
+        'SEXO': rng.choice([1, 2], n_rows),
+        'ENTIDAD_NAC': rng.choice([*range(1, 33), 99], n_rows),
+        'ENTIDAD_RES': rng.randint(1, 33, n_rows),
+        'MUNICIPIO_RES': rng.randint(1, N_MUNICIPALITIES + 1, n_rows),
+        'TIPO_PACIENTE': rng.choice([1, 2], n_rows, p=[0.8, 0.2]),
+        'FECHA_INGRESO': pd.Series(admission).dt.strftime('%Y-%m-%d').to_numpy(),
+        'FECHA_SINTOMAS': pd.Series(symptoms).dt.strftime('%Y-%m-%d').to_numpy(),
+        'FECHA_DEF': np.where(dead, pd.Series(death).dt.strftime('%Y-%m-%d').to_numpy(), '9999-99-99'),
+    })
+    for col in SI_NO_COLS:
+        df[col] = rng.choice([1, 2, 97, 98], n_rows, p=[0.1, 0.8, 0.08, 0.02])
+    df['EDAD'] = rng.randint(0, 100, n_rows)
+    df['NACIONALIDAD'] = rng.choice([1, 2], n_rows, p=[0.99, 0.01])
+    df['RESULTADO'] = rng.choice([1, 2, 3], n_rows, p=[0.3, 0.5, 0.2])
+    df['PAIS_NACIONALIDAD'] = np.where(df['NACIONALIDAD'] == 1, 'México', '99')
+    df['PAIS_ORIGEN'] = '97'
+    # Records with unknown municipality
+    df.loc[rng.rand(n_rows) < 0.01, 'MUNICIPIO_RES'] = 999
+
+    return df[[name if name != 'OTRAS_COM' else 'OTRA_COM' for name, _ in DESCRIPTION]]
+
+
+def write_data(path, n_rows, seed=0, date='2020-06-01', chunk_rows=CHUNK_ROWS):
+    """
+    Writes a zip with a DGE csv of n_rows records in chunks of chunk_rows.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    csv_name = pd.Timestamp(date).strftime('%y%m%d') + 'COVID19MEXICO.csv'
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        with zip_ref.open(csv_name, 'w', force_zip64=True) as f:
+            text = io.TextIOWrapper(f, encoding='UTF-8', newline='')
+            for i, start in enumerate(range(0, n_rows, chunk_rows)):
+                chunk = make_chunk(min(chunk_rows, n_rows - start), start, seed + i, date)
+                chunk.to_csv(text, index=False, header=i == 0)
+            text.flush()
+            text.detach()
+
+    return path
+
+
+def write_dictionary(path):
+    """
+    Writes a zip with the catalogue and description workbooks.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    catalogue = io.BytesIO()
+    with pd.ExcelWriter(catalogue) as writer:
+        for sheet, mapping in CATALOGUES.items():
+            pd.DataFrame({'CLAVE': list(mapping), 'DESCRIPCIÓN': list(mapping.values())}) \
+              .to_excel(writer, sheet_name=sheet, index=False)
+        pd.DataFrame({
+            'CLAVE_ENTIDAD': list(STATES),
+            'ENTIDAD_FEDERATIVA': list(STATES.values()),
+            'ABREVIATURA': 'XX'
+        }).to_excel(writer, sheet_name='Catálogo de ENTIDADES', index=False)
+        municipalities = [(mun, ent, 'MUNICIPIO {} {}'.format(mun, ent)) \
+                          for ent in range(1, 33) for mun in [*range(1, N_MUNICIPALITIES + 1), 999]]
+        pd.DataFrame(municipalities, columns=['CLAVE_MUNICIPIO', 'CLAVE_ENTIDAD', 'MUNICIPIO']) \
+          .to_excel(writer, sheet_name='Catálogo MUNICIPIOS', index=False)
+
+    description = io.BytesIO()
+    pd.DataFrame({
+        'Nº': range(1, len(DESCRIPTION) + 1),
+        'NOMBRE DE VARIABLE': [name for name, _ in DESCRIPTION],
+        'DESCRIPCIÓN DE VARIABLE': '',
+        'FORMATO O FUENTE': [formato for _, formato in DESCRIPTION]
+    }).to_excel(description, index=False)
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr('diccionario_datos_covid19/', '')
+        zip_ref.writestr('diccionario_datos_covid19/Catalogos_0412.xlsx', catalogue.getvalue())
+        zip_ref.writestr('diccionario_datos_covid19/Descriptores_0412.xlsx', description.getvalue())
+
+    return path
+
+
+def write_serendipia(directory, date, n_rows, seed=0):
+    """
+    Writes Serendipia confirmed and suspects csv files of date
+    (after 2020-04-19 naming) inside directory.
+    """
+    rng = np.random.RandomState(seed)
+    date = pd.Timestamp(date)
+    folder = os.path.join(directory, SERENDIPIA_DIR.format(date.strftime('%Y'), date.strftime('%m')))
+    os.makedirs(folder, exist_ok=True)
+
+    files = []
+    for kind in ['', 'sospechosos-']:
+        df = pd.DataFrame({
+            'N° Caso': np.arange(1, n_rows + 1).astype(str),
+            'Estado': rng.choice(list(STATES.values())[:32], n_rows),
+            'Sexo': rng.choice(['M', 'F'], n_rows),
+            'Edad': rng.randint(0, 100, n_rows),
+            'Fecha de Inicio de síntomas': (date - pd.to_timedelta(rng.randint(1, 60, n_rows), 'D')).strftime('%d/%m/%Y'),
+            'Identificación de COVID-19 por RT-PCR en tiempo real': 'Confirmado' if not kind else 'Sospechoso',
+        })
+        footer = pd.DataFrame({'N° Caso': ['Fuente: Secretaría de Salud']})
+        path = os.path.join(folder, 'covid-19-mexico-{}{}.csv'.format(kind, date.strftime('%d%m%Y')))
+        pd.concat([df, footer], sort=False).to_csv(path, index=False)
+        files.append(path)
+
+    return files
+
+
+def write_fixtures(directory, n_rows, historical_dates=(), serendipia_dates=(), seed=0):
+    """
+    Writes every file served by the stand-in server inside directory:
+    current data with n_rows records, dictionary, historical publications
+    of historical_dates and Serendipia files of serendipia_dates.
+    Existing files are kept.
+    """
+    data_path = os.path.join(directory, DATA_FILE)
+    if not os.path.exists(data_path):
+        write_data(data_path, n_rows, seed)
+
+    dictionary_path = os.path.join(directory, DICTIONARY_FILE)
+    if not os.path.exists(dictionary_path):
+        write_dictionary(dictionary_path)
+
+    for i, date in enumerate(historical_dates):
+        date = pd.Timestamp(date)
+        path = os.path.join(directory, HISTORICAL_FILE.format(date.strftime('%d.%m.%Y')))
+        if not os.path.exists(path):
+            write_data(path, n_rows, seed + i + 1, date.strftime('%Y-%m-%d'))
+
+    for i, date in enumerate(serendipia_dates):
+        write_serendipia(directory, date, min(n_rows, 100000), seed + i)
+
+    return directory
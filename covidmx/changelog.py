@@ -0,0 +1,210 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from covidmx.locking import FileLock
+from covidmx.utils import CACHE_EXTENSIONS, resolve_cache_format
+from covidmx.utils import concat_frames, read_table, write_table
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OPERATION_COL = 'operacion'
+PUBLICATION_COL = 'fecha_publicacion'
+INSERT, UPDATE, DELETE = 'insert', 'update', 'delete'
+
+
+class ChangeLog:
+    """
+    Append-only change log of DGE publications.
+
+    Each publication is compared with the previous one using key and
+    a hash of the remaining columns. Only inserted and updated records
+    (and the keys of deleted ones) are stored, so any stored publication
+    can be reconstructed without keeping full snapshots. Row order of
+    reconstructed publications is not preserved.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the change log.
+    key: str
+        Column identifying each record.
+    ignore: list
+        Columns excluded from the row hash because they change on every
+        publication (e.g. fecha_actualizacion). Their value is stored once
+        per publication and restored on reconstruction.
+    cache_format: str
+        Format of stored files. Allowed: 'parquet', 'feather', 'csv'.
+    """
+
+    def __init__(self, path, key='id_registro', ignore=('fecha_actualizacion',),
+                 cache_format='parquet'):
+        self.path = path
+        self.key = key
+        self.ignore = list(ignore)
+        self.cache_format = resolve_cache_format(cache_format)
+        self.extension = CACHE_EXTENSIONS[self.cache_format]
+
+        os.makedirs(self.path, exist_ok=True)
+
+    @property
+    def dates(self):
+        """Publication dates stored in the change log."""
+        publications = self.read_publications()
+        if publications is None:
+            return []
+
+        return pd.to_datetime(publications[PUBLICATION_COL]).tolist()
+
+    def append(self, df, date):
+        """
+        Stores the changes of publication date with respect
+        to the last stored publication.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            Full publication.
+        date: str or pd.Timestamp
+            Publication date. Must be later than the stored dates.
+
+        Returns
+        -------
+        Dict with the number of inserted, updated and deleted records.
+        """
+        # Appends of other processes are serialized
+        with FileLock(self.publications_file()):
+            date = pd.to_datetime(date)
+            dates = self.dates
+            if dates and date <= dates[-1]:
+                raise ValueError('Publication {} is not later than {}'.format(date.date(), dates[-1].date()))
+
+            hashes = self.hash_rows(df).to_numpy()
+            previous = self.read_state()
+
+            if previous is None:
+                status = np.full(len(df), INSERT, dtype=object)
+                deleted = []
+            else:
+                positions = previous.index.get_indexer(df[self.key])
+                previous_hash = previous.to_numpy()[positions]
+                status = np.where(positions == -1, INSERT,
+                                  np.where(previous_hash == hashes, None, UPDATE))
+                deleted = previous.index[~previous.index.isin(df[self.key])]
+
+            changed = status != None  # noqa: E711
+            upserts = df[changed].drop(columns=self.ignore, errors='ignore')
+            upserts.insert(0, OPERATION_COL, status[changed])
+            deletes = pd.DataFrame({self.key: deleted})
+
+            write_table(upserts.reset_index(drop=True), self.changes_file(date), self.cache_format)
+            write_table(deletes, self.deletes_file(date), self.cache_format)
+            write_table(pd.DataFrame({self.key: df[self.key].to_numpy(), 'hash': hashes}),
+                        self.state_file(), self.cache_format)
+            self.write_publication(df, date)
+
+        counts = upserts[OPERATION_COL].value_counts()
+        counts = {
+            INSERT: int(counts.get(INSERT, 0)),
+            UPDATE: int(counts.get(UPDATE, 0)),
+            DELETE: len(deletes)
+        }
+        logger.info('Publication {} stored: {}'.format(date.date(), counts))
+
+        return counts
+
+    def reconstruct(self, date, columns=None):
+        """
+        Returns the publication of date rebuilt from the change log.
+
+        Parameters
+        ----------
+        date: str or pd.Timestamp
+            Stored publication date.
+        columns: list
+            Only return these columns. Default None (all columns).
+        """
+        date = pd.to_datetime(date)
+        dates = [dt for dt in self.dates if dt <= date]
+        if not dates or dates[-1] != date:
+            raise ValueError('Publication {} not stored'.format(date.date()))
+
+        read_cols = None
+        if columns is not None:
+            read_cols = [self.key] + \
+                        [col for col in columns if col not in self.ignore and col != self.key]
+
+        # Last version of each record and last publication where it was deleted
+        upserts = concat_frames(
+            read_table(self.changes_file(dt), self.cache_format, read_cols).assign(**{PUBLICATION_COL: i}) \
+            for i, dt in enumerate(dates)
+        ).drop_duplicates(self.key, keep='last')
+        deletes = pd.concat(
+            [read_table(self.deletes_file(dt), self.cache_format).assign(**{PUBLICATION_COL: i}) \
+             for i, dt in enumerate(dates)],
+            ignore_index=True, sort=False
+        ).drop_duplicates(self.key, keep='last')
+
+        last_delete = pd.Series(deletes[PUBLICATION_COL].to_numpy(), index=deletes[self.key])
+        last_delete = last_delete.reindex(upserts[self.key]).to_numpy()
+        alive = pd.isnull(last_delete) | (upserts[PUBLICATION_COL].to_numpy() > last_delete)
+        df = upserts[alive].drop(columns=[PUBLICATION_COL, OPERATION_COL], errors='ignore')
+
+        publications = self.read_publications()
+        publication = publications[pd.to_datetime(publications[PUBLICATION_COL]) == date]
+        for col in self.ignore:
+            if col in publication and (columns is None or col in columns):
+                df[col] = publication[col].iloc[0]
+
+        if columns is not None:
+            df = df[columns]
+
+        return df.reset_index(drop=True)
+
+    def hash_rows(self, df):
+        """Returns a uint64 hash of each row excluding key and ignored columns."""
+        cols = [col for col in df.columns if col != self.key and col not in self.ignore]
+
+        return pd.util.hash_pandas_object(df[cols], index=False)
+
+    def read_state(self):
+        """Returns row hashes of the last publication indexed by key."""
+        if not os.path.exists(self.state_file()):
+            return None
+
+        state = read_table(self.state_file(), self.cache_format)
+
+        return pd.Series(state['hash'].to_numpy(), index=state[self.key])
+
+    def read_publications(self):
+        """Returns the table of stored publications."""
+        if not os.path.exists(self.publications_file()):
+            return None
+
+        return read_table(self.publications_file(), self.cache_format)
+
+    def write_publication(self, df, date):
+        publication = df[[col for col in self.ignore if col in df]].iloc[:1].reset_index(drop=True)
+        publication.insert(0, PUBLICATION_COL, [date])
+
+        publications = self.read_publications()
+        if publications is not None:
+            publications[PUBLICATION_COL] = pd.to_datetime(publications[PUBLICATION_COL])
+            publication = pd.concat([publications, publication], ignore_index=True, sort=False)
+
+        write_table(publication, self.publications_file(), self.cache_format)
+
+    def changes_file(self, date):
+        return os.path.join(self.path, 'cambios_' + date.strftime('%Y-%m-%d') + self.extension)
+
+    def deletes_file(self, date):
+        return os.path.join(self.path, 'bajas_' + date.strftime('%Y-%m-%d') + self.extension)
+
+    def state_file(self):
+        return os.path.join(self.path, 'estado' + self.extension)
+
+    def publications_file(self):
+        return os.path.join(self.path, 'publicaciones' + self.extension)
@@ -1,7 +1,3 @@
-from covidmx.serendipia import Serendipia
-from covidmx.dge import DGE
-
-
 def CovidMX(source="DGE", **kwargs):
     """
     Returns COVID19 data from source.
@@ -18,7 +14,11 @@ def CovidMX(source="DGE", **kwargs):
         date (str): To get historical data published that date.
         date_format (str): Format of supplied date.
     Kwargs (source="Serendipia"):
-        date (str): Date to consider. If not present returns last found data.
+        date (str or list): Date(s) to consider. If not present returns last found data.
+        start_date (str): First date of a range of dates. Days without data are skipped.
+        end_date (str): Last date of the range. Default today.
+        data_path (str): Directory where downloaded files are cached by date.
+        n_jobs (int): Number of threads used to probe and download files.
         kind (str): Kind of data. Allowed: 'confirmed', 'suspects'. If not present returns both.
         clean (bool): Whether data cleaning will be performed. Default True (recommended).
         add_search_date (bool): Wheter add date to the DFs.
@@ -29,8 +29,11 @@ def CovidMX(source="DGE", **kwargs):
     assert source in allowed_sources, \
         "CovidMX only supports {} as sources".format(', '.join(allowed_sources))
 
+    # Sources are imported on demand, so importing covidmx stays cheap
     if source == "DGE":
+        from covidmx.dge import DGE
         return DGE(**kwargs)
 
     if source == "Serendipia":
+        from covidmx.serendipia import Serendipia
         return Serendipia(**kwargs)
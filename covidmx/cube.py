@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+
+from covidmx.decoder import parse_municipality_label
+from covidmx.utils import read_table, write_table
+
+STATUS = ['confirmados', 'negativos', 'sospechosos', 'muertos']
+DIMENSIONS = ['entidad_res', 'cve_ent', 'municipio_res', 'cve_mun']
+DATE_COLS = ['fecha_sintomas', 'fecha_ingreso']
+# Columns of cleaned data needed to build the cube
+CUBE_COLUMNS = ['entidad_res', 'entidad_res_original', 'municipio_res',
+                'municipio_res_original', 'resultado', 'fecha_def',
+                'fecha_actualizacion'] + DATE_COLS
+
+REPLACE_RESULTADO = {
+    'Positivo SARS-CoV-2': 'confirmados',
+    'No positivo SARS-CoV-2': 'negativos',
+    'Resultado pendiente': 'sospechosos'
+}
+
+
+def status_indicators(resultado):
+    """
+    Returns a boolean indicator of each status in REPLACE_RESULTADO.
+    Categorical resultado is compared by code, without dummies.
+    """
+    if isinstance(resultado.dtype, pd.CategoricalDtype):
+        codes = resultado.cat.codes.to_numpy()
+        categories = resultado.cat.categories
+        return {
+            status: codes == categories.get_loc(label) if label in categories \
+                    else np.zeros(len(resultado), dtype=bool) \
+            for label, status in REPLACE_RESULTADO.items()
+        }
+
+    values = resultado.to_numpy()
+    return {status: values == label for label, status in REPLACE_RESULTADO.items()}
+
+
+def prepare_data(df, columns=None):
+    """
+    Adds boolean status indicators (confirmados, negativos, sospechosos,
+    muertos) to cleaned DGE data and renames original state and
+    municipality columns to cve_ent and cve_mun.
+
+    The input frame is not modified and its columns are not copied.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Cleaned DGE data.
+    columns: list
+        Only keep these columns of df. Default None (all columns).
+    """
+    if columns is not None:
+        df = df[[col for col in columns if col in df]]
+    # Shallow copy, new columns are not added to the input frame
+    df = df.copy(deep=False)
+
+    df.rename(columns={
+              'entidad_res_original': 'cve_ent',
+              'municipio_res_original': 'cve_mun'
+              }, inplace=True)
+    if 'cve_mun' in df:
+        df['cve_mun'] = parse_municipality_label(df['cve_mun'])
+
+    for status, indicator in status_indicators(df['resultado']).items():
+        df[status] = indicator
+    df['muertos'] = df['fecha_def'].notna().to_numpy()
+
+    if isinstance(df['resultado'].dtype, pd.CategoricalDtype):
+        df['resultado'] = df['resultado'].cat.rename_categories(
+            lambda cat: REPLACE_RESULTADO.get(cat, cat)
+        )
+    else:
+        df['resultado'] = df['resultado'].replace(REPLACE_RESULTADO)
+
+    return df
+
+
+class DGECube:
+    """
+    Pre-aggregated counts of DGE data by state, municipality,
+    date and status.
+
+    Each record is counted once per date column in DATE_COLS; the
+    date column is identified by tipo_fecha and its value by fecha.
+
+    Parameters
+    ----------
+    cube: pd.DataFrame
+        Aggregated counts as returned by DGECube.aggregate.
+    """
+
+    def __init__(self, cube):
+        self.cube = cube
+
+    @classmethod
+    def from_data(cls, df, date_cols=DATE_COLS):
+        """
+        Builds the cube from cleaned DGE data including
+        entidad_res_original and municipio_res_original.
+        """
+        columns = CUBE_COLUMNS + [col for col in date_cols if col not in CUBE_COLUMNS]
+
+        return cls(cls.aggregate(prepare_data(df, columns), date_cols))
+
+    @staticmethod
+    def aggregate(df, date_cols=DATE_COLS):
+        """
+        Returns status counts of prepared data grouped by
+        DIMENSIONS and each of date_cols.
+        """
+        update_date = df['fecha_actualizacion'].max()
+
+        cubes = []
+        for date_col in date_cols:
+            cube = df.groupby(DIMENSIONS + [date_col], observed=True, dropna=False)[STATUS] \
+                     .sum() \
+                     .astype('int64') \
+                     .reset_index() \
+                     .rename(columns={date_col: 'fecha'})
+            cube.insert(len(DIMENSIONS), 'tipo_fecha', date_col)
+            cubes.append(cube)
+
+        cube = pd.concat(cubes, ignore_index=True)
+        cube['tipo_fecha'] = cube['tipo_fecha'].astype('category')
+        cube['fecha_actualizacion'] = update_date
+
+        return cube
+
+    @classmethod
+    def read(cls, path, cache_format='parquet'):
+        cube = read_table(path, cache_format)
+        # csv caches do not keep dtypes
+        for col in ['fecha', 'fecha_actualizacion']:
+            cube[col] = pd.to_datetime(cube[col])
+        cube['tipo_fecha'] = cube['tipo_fecha'].astype('category')
+        cube['cve_mun'] = parse_municipality_label(cube['cve_mun'])
+
+        return cls(cube)
+
+    def write(self, path, cache_format='parquet'):
+        write_table(self.cube, path, cache_format)
+
+    @property
+    def update_date(self):
+        return self.cube['fecha_actualizacion'].max()
+
+    @property
+    def available_states(self):
+        return self.cube['entidad_res'].dropna().unique()
+
+    def query(self, status=STATUS, by=('entidad_res', 'cve_ent'), state=None,
+              date_col='fecha_sintomas', start_date=None, end_date=None):
+        """
+        Returns counts of status grouped by columns in by.
+
+        Parameters
+        ----------
+        status: str or list
+            Status to count.
+        by: list
+            Columns of the cube to group by. Include 'fecha' for series.
+        state: str
+            Only count records of this state (entidad_res).
+        date_col: str
+            Date column used to filter and group by 'fecha'.
+        start_date, end_date: str or pd.Timestamp
+            Inclusive date range of date_col.
+        """
+        status = [status] if isinstance(status, str) else list(status)
+        cube = self.cube[self.cube['tipo_fecha'] == date_col]
+
+        if state is not None:
+            cube = cube[cube['entidad_res'].str.lower() == state.lower()]
+        if start_date is not None:
+            cube = cube[cube['fecha'] >= pd.to_datetime(start_date)]
+        if end_date is not None:
+            cube = cube[cube['fecha'] <= pd.to_datetime(end_date)]
+
+        return cube.groupby(list(by), observed=True)[status].sum().reset_index()
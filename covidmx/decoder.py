@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+
+# Municipality keys are cve_ent * MUNICIPALITY_FACTOR + cve_mun
+MUNICIPALITY_FACTOR = 1000
+
+
+class CodeTable:
+    """
+    Compiled catalogue used to decode DGE codes into pandas.Categorical.
+
+    Parameters
+    ----------
+    mapping: dict
+        Code to label mapping (as returned by DGE.get_dict_replace).
+    """
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+        labels = [label for label in mapping.values() if not pd.isnull(label)]
+        self.categories = list(dict.fromkeys(labels))
+        label_position = {label: idx for idx, label in enumerate(self.categories)}
+        self.positions = {
+            code: label_position.get(label, -1) \
+            for code, label in mapping.items()
+        }
+
+        self.lookup = None
+        self.offset = 0
+        int_keys = [code for code in mapping if isinstance(code, (int, np.integer))]
+        if int_keys and len(int_keys) == len(mapping):
+            self.offset = min(int_keys)
+            self.lookup = np.full(max(int_keys) - self.offset + 1, -1, dtype=np.int64)
+            for code in int_keys:
+                self.lookup[code - self.offset] = self.positions[code]
+
+    def decode(self, values):
+        """
+        Decodes values into a categorical Series with the same index.
+        Codes not present in the catalogue are kept as extra
+        categories (as strings), missing values stay missing.
+
+        Parameters
+        ----------
+        values: pd.Series
+            Encoded column.
+        """
+        if self.lookup is not None and isinstance(values.dtype, np.dtype) and values.dtype.kind in 'iu':
+            codes, unknown = self._decode_integers(values.to_numpy())
+        else:
+            codes, unknown = self._decode_factorized(values)
+
+        categories = self.categories
+        if len(unknown):
+            extra = sorted(set(str(value) for value in unknown) - set(categories))
+            categories = categories + extra
+            extra_position = {label: idx for idx, label in enumerate(categories)}
+            for value, mask in unknown.items():
+                codes[mask] = extra_position[str(value)]
+
+        decoded = pd.Categorical.from_codes(codes, categories=categories)
+
+        return pd.Series(decoded, index=values.index, name=values.name)
+
+    def _decode_integers(self, raw):
+        shifted = raw - self.offset
+        in_range = (shifted >= 0) & (shifted < len(self.lookup))
+        codes = np.full(len(raw), -1, dtype=np.int64)
+        codes[in_range] = self.lookup[shifted[in_range]]
+
+        unknown = {}
+        missing = ~in_range | (codes == -1)
+        if missing.any():
+            for value in np.unique(raw[missing]):
+                unknown[value] = raw == value
+
+        return codes, unknown
+
+    def _decode_factorized(self, values):
+        uniques_codes, uniques = pd.factorize(values)
+        unique_positions = np.array(
+            [self.positions.get(value, -1) for value in uniques],
+            dtype=np.int64
+        )
+        codes = np.full(len(uniques_codes), -1, dtype=np.int64)
+        not_null = uniques_codes >= 0
+        codes[not_null] = unique_positions[uniques_codes[not_null]]
+
+        unknown = {}
+        for idx in np.flatnonzero(unique_positions == -1):
+            unknown[uniques[idx]] = uniques_codes == idx
+
+        return codes, unknown
+
+
+class DateTable:
+    """
+    Memoized parser of date strings in one format. Each distinct value is
+    parsed once and kept, so date columns sharing the format (and later
+    chunks) only parse values not seen before.
+
+    Parameters
+    ----------
+    formato: str
+        strftime format of the dates.
+    """
+
+    def __init__(self, formato):
+        self.formato = formato
+        self.parsed = None
+
+    def decode(self, values):
+        """
+        Returns values parsed as datetimes, like
+        pd.to_datetime(values, format=formato, errors='coerce').
+
+        Parameters
+        ----------
+        values: pd.Series
+            Date strings.
+        """
+        codes, uniques = pd.factorize(values)
+        if not len(uniques):
+            return pd.to_datetime(values, format=self.formato, errors='coerce')
+        uniques = pd.Index(uniques, dtype=object)
+
+        if self.parsed is None:
+            new = uniques
+        else:
+            new = uniques[~uniques.isin(self.parsed.index)]
+        if len(new):
+            parsed = pd.Series(pd.to_datetime(new, format=self.formato, errors='coerce'), index=new)
+            self.parsed = parsed if self.parsed is None else pd.concat([self.parsed, parsed])
+
+        dates = self.parsed.reindex(uniques).to_numpy()
+        dates = np.append(dates, np.array('NaT', dtype=dates.dtype))
+
+        return pd.Series(dates[codes], index=values.index, name=values.name)
+
+
+def compile_catalogue(catalogo_dict):
+    """
+    Compiles every code to label mapping of catalogo_dict
+    into a CodeTable.
+
+    Parameters
+    ----------
+    catalogo_dict: dict
+        Catalogue name to code-label mapping.
+    """
+    return {key: CodeTable(mapping) for key, mapping in catalogo_dict.items()}
+
+
+def municipality_key(cve_ent, cve_mun):
+    """
+    Returns the integer key of each municipality, cve_ent * 1000 + cve_mun.
+    Missing codes give missing keys (Int64).
+
+    Parameters
+    ----------
+    cve_ent: pd.Series
+        State codes.
+    cve_mun: pd.Series
+        Municipality codes inside each state.
+    """
+    key = cve_ent.astype('Int64') * MUNICIPALITY_FACTOR + cve_mun.astype('Int64')
+    if key.hasnans:
+        return key
+
+    return key.astype('int64')
+
+
+def parse_municipality_label(label):
+    """
+    Returns the municipality keys of '<ent>_<mun>' strings,
+    the format of caches written by previous versions.
+    Integer keys are returned unchanged.
+    """
+    if pd.api.types.is_numeric_dtype(label):
+        return label
+
+    codes, uniques = pd.factorize(label)
+    keys = [int(ent) * MUNICIPALITY_FACTOR + int(mun) \
+            for ent, mun in (value.split('_') for value in uniques)]
+    keys = pd.array(keys + [None], dtype='Int64')
+
+    return pd.Series(keys[codes], index=label.index, name=label.name)
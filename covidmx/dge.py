@@ -1,16 +1,31 @@
 import logging
-import wget
+import multiprocessing
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import os
 import zipfile
 import shutil
 from io import BytesIO
 import requests
 from zipfile import ZipFile
+import numpy as np
 import pandas as pd
-from itertools import product
-from unidecode import unidecode
-from covidmx.utils import download_file, translate_serendipia
-from covidmx.dge_plot import DGEPlot
+from itertools import product, repeat
+from covidmx.changelog import ChangeLog
+from covidmx.cube import CUBE_COLUMNS, DGECube
+from covidmx.series import SERIES_COLUMNS, EpiCurves
+from covidmx.decoder import DateTable, compile_catalogue, municipality_key
+from covidmx.geometry import GeoCache
+from covidmx.downloader import file_checksum
+from covidmx.locking import FileLock, atomic_path
+from covidmx.utils import download_file, read_metadata, translate_serendipia
+from covidmx.utils import CACHE_EXTENSIONS, resolve_cache_format, resolve_parser
+from covidmx.utils import iter_csv_arrow, read_csv_arrow
+from covidmx.utils import concat_frames, filter_mask
+from covidmx.utils import read_table, read_table_columns, write_chunks, write_table
+from covidmx.utils import ZipMember, get_size, open_source, zip_members
+from covidmx.stats import stage
 
 pd.options.mode.chained_assignment = None
 
@@ -18,6 +33,20 @@ URL_DATA = 'http://datosabiertos.salud.gob.mx/gobmx/salud/datos_abiertos/datos_a
 URL_DESCRIPTION = 'http://datosabiertos.salud.gob.mx/gobmx/salud/datos_abiertos/diccionario_datos_covid19.zip'
 URL_HISTORICAL = 'http://187.191.75.115/gobmx/salud/datos_abiertos/historicos/datos_abiertos_covid19_{}.zip'
 
+HISTORICAL_START = pd.to_datetime('2020-04-12')
+
+# Bump when the compiled dictionary changes
+DICTIONARY_CACHE_VERSION = 4
+# Format of free text variables in the compiled description
+TEXT_FORMAT = 'TEXTO'
+
+SAMPLE_ROWS = 10000
+MIN_CHUNKSIZE = 1000
+# Cleaning a chunk holds the raw chunk, decoded columns and original copies
+CLEANING_OVERHEAD = 4
+# Smaller frames are not split across worker processes
+MIN_PARTITION_ROWS = 50000
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -31,41 +60,157 @@ class DGE:
             return_catalogo=False,
             return_descripcion=False,
             date=None,
-            date_format='%d-%m-%Y'):
+            date_format='%d-%m-%Y',
+            cache_format='parquet',
+            chunksize=None,
+            memory_budget=None,
+            extract=False,
+            download_segments=1,
+            stats=None,
+            parser='pandas',
+            dtype_backend=None,
+            n_jobs=1):
         """
         Returns COVID19 data from the Direccion General de Epidemiología
 
+        Parameters
+        ----------
+        cache_format: str
+            Format used to store cleaned data inside data_path.
+            Allowed: 'parquet', 'feather', 'csv'. Columnar formats keep
+            dtypes and fall back to 'csv' if pyarrow is not installed.
+        chunksize: int
+            If present, the csv is read and cleaned in chunks of chunksize
+            rows that are written straight to the cache.
+        memory_budget: int
+            Approximate bytes available to clean each chunk. Used to
+            derive chunksize when it is not present.
+        extract: bool
+            Whether downloaded zip files are extracted to data_path.
+            Default False, csv and excel files are read directly
+            from the archives.
+        download_segments: int
+            Number of parallel range requests used to download
+            the data archive. Default 1.
+        stats: PipelineStats
+            Records wall time, bytes, rows and peak memory of each stage
+            (download, decompress, dictionary, parse, decode of each
+            column, cache read/write, aggregate). Optional.
+        parser: str
+            Csv parser. Allowed: 'pandas', 'pyarrow'. The pyarrow parser
+            is multi-threaded and uses column types derived from the
+            description sheet. Falls back to 'pandas' if pyarrow is
+            not installed.
+        dtype_backend: str
+            Use 'pyarrow' to keep columns parsed by the pyarrow parser in
+            Arrow memory (pd.ArrowDtype) through decoding and caching.
+            Requires pandas>=1.5. Default None (numpy dtypes).
+        n_jobs: int
+            Number of worker processes used to clean the data. Row
+            partitions (or chunks, if streaming) are decoded in parallel
+            with the same result as the serial path. Default 1 (serial),
+            None uses every cpu.
         """
         self.data_path = data_path
         self.clean = clean
         self.return_catalogo = return_catalogo
         self.return_descripcion = return_descripcion
+        self.cache_format = resolve_cache_format(cache_format)
+        self.chunksize = chunksize
+        self.memory_budget = memory_budget
+        self.extract = extract
+        self.download_segments = download_segments
+        self.stats = stats
+        self.parser = resolve_parser(parser)
+        assert dtype_backend != 'pyarrow' or hasattr(pd, 'ArrowDtype'), \
+            "dtype_backend='pyarrow' requires pandas>=1.5"
+        self.dtype_backend = dtype_backend
+        self.n_jobs = n_jobs
+        self.date_tables = {}
 
         self.date = date
         if date is not None:
             self.date = pd.to_datetime(date, format=date_format)
-            if self.date >= pd.to_datetime('2020-04-12'):
+            if self.date < HISTORICAL_START:
                 raise Exception('Historical data only available as of 2020-04-12')
 
-    def get_data(self, preserve_original=None):
-        
-        if not os.path.exists(self.data_path):
-            os.mkdir(self.data_path)
-        clean_data_file= os.path.join(self.data_path, os.path.split(URL_DATA)[1]).replace("zip", "csv")
-        
-        logger.info('Reading data from Direccion General de Epidemiologia...')
-        df, catalogo, descripcion = self.read_data()
-        logger.info('Data readed')
-
-        if self.clean and not os.path.exists(clean_data_file):
-            logger.info('Cleaning data')
-            df = self.clean_data(df, catalogo, descripcion, preserve_original)
-            if self.data_path is not None:
-                logger.info("Save cleaned database " + clean_data_file)
-                df.to_csv(clean_data_file, index=False)
-        elif self.clean and os.path.exists(clean_data_file):
-                logger.info("Open cleaned " + clean_data_file)
-                df = pd.read_csv(clean_data_file)
+    def get_data(self, preserve_original=None, columns=None, filters=None):
+        """
+        Returns DGE data, cleaned if clean=True.
+
+        Parameters
+        ----------
+        preserve_original: list
+            Columns whose original values will be kept.
+        columns: list
+            Only return these columns. Default None (all columns).
+        filters: list
+            Only return rows matching every (column, op, value) filter,
+            e.g. [('entidad_res', '==', 'JALISCO'), ('fecha_sintomas', '>=', '2020-04-01')].
+            op is one of ==, !=, <, <=, >, >=, in, not in. Values are
+            decoded values if clean=True.
+
+        Columns and filters are pushed down to the cleaned data cache, or
+        to the csv reader if it does not exist: only needed columns are
+        parsed and decoded, and rows are filtered before decoding the
+        remaining columns. Selections are not written to the cache.
+
+        Processes sharing data_path build the cleaned data cache once:
+        the first one holds a lock on it while the rest wait and
+        read the published cache.
+        """
+
+        os.makedirs(self.data_path, exist_ok=True)
+        clean_data_file = self.get_clean_data_file()
+
+        # The dictionary is downloaded and parsed while the data is fetched
+        prefetch = self.return_catalogo or self.return_descripcion or \
+            (self.clean and not os.path.exists(clean_data_file))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            dictionary = executor.submit(self.read_dictionary) if prefetch else None
+            data_file = self.get_data_file()
+
+            # Only one process builds the cache, the rest wait for its lock
+            builds_cache = self.clean and columns is None and filters is None and \
+                not self.is_cached(clean_data_file, data_file, preserve_original)
+            with FileLock(clean_data_file) if builds_cache else nullcontext():
+                if self.clean and self.is_cached(clean_data_file, data_file, preserve_original):
+                    logger.info("Open cleaned " + clean_data_file)
+                    df = self.read_cache(clean_data_file, self.format_columns(columns),
+                                         self.format_filters(filters))
+
+                    catalogo, descripcion = None, None
+                    if self.return_catalogo or self.return_descripcion:
+                        catalogo, descripcion = self.wait_dictionary(dictionary)
+                elif columns is not None or filters is not None:
+                    logger.info('Reading selected data from Direccion General de Epidemiologia...')
+                    catalogo, descripcion = None, None
+                    if self.clean or self.return_catalogo or self.return_descripcion:
+                        catalogo, descripcion = self.wait_dictionary(dictionary)
+                    chunks = self.iter_selected_chunks(data_file, catalogo, descripcion,
+                                                       preserve_original, columns, filters)
+                    df = concat_frames(chunks)
+                elif self.clean and self.is_streaming():
+                    logger.info('Reading data in chunks from Direccion General de Epidemiologia...')
+                    catalogo, descripcion = self.wait_dictionary(dictionary)
+                    chunks = self.iter_clean_chunks(data_file, catalogo,
+                                                    descripcion, preserve_original)
+                    logger.info("Save cleaned database " + clean_data_file)
+                    self.write_cache(chunks, clean_data_file)
+                    df = self.read_cache(clean_data_file)
+                else:
+                    logger.info('Reading data from Direccion General de Epidemiologia...')
+                    df, catalogo, descripcion = self.read_data(data_path=data_file,
+                                                               dictionary=dictionary)
+                    logger.info('Data readed')
+
+                    if self.clean:
+                        logger.info('Cleaning data')
+                        df = self.clean_data(df, catalogo, descripcion, preserve_original)
+                        if self.data_path is not None:
+                            logger.info("Save cleaned database " + clean_data_file)
+                            self.write_cache(df, clean_data_file)
 
         logger.info('Ready!')
 
@@ -81,18 +226,321 @@ class DGE:
 
         return df
 
-    def get_encoded_data(self, path, encoding='UTF-8'):
+    def get_clean_data_file(self, date=None):
+        """
+        Returns the path of the cleaned data cache of the publication
+        of date (default self.date). Historical publications are
+        stored under their own date.
+        """
+        date = self.date if date is None else date
+        file_name = os.path.splitext(os.path.split(URL_DATA)[1])[0]
+        if date is not None:
+            file_name += '_' + date.strftime('%d.%m.%Y')
+        file_name += CACHE_EXTENSIONS[self.cache_format]
+
+        return os.path.join(self.data_path, file_name)
+
+    def is_cached(self, clean_data_file, data_file=None, preserve_original=None):
+        """
+        Whether clean_data_file exists, is newer than the downloaded
+        data_file and includes the original columns requested
+        in preserve_original.
+        """
+        if not os.path.exists(clean_data_file):
+            return False
+
+        if data_file is not None:
+            source = data_file.archive if isinstance(data_file, ZipMember) else data_file
+            if os.path.getmtime(clean_data_file) < os.path.getmtime(source):
+                return False
+
+        if not preserve_original:
+            return True
+
+        cached_cols = read_table_columns(clean_data_file, self.cache_format)
+        needed_cols = [col.lower() + '_original' for col in preserve_original]
+
+        return all(col in cached_cols for col in needed_cols)
+
+    def is_streaming(self):
+        """
+        Whether data will be read and cleaned in chunks.
+        """
+        return self.chunksize is not None or self.memory_budget is not None
+
+    def read_cache(self, path, columns=None, filters=None):
+        """
+        Returns the table in path (see read_table).
+        """
+        with stage(self.stats, 'cache_read', file=os.path.basename(path)) as record:
+            df = read_table(path, self.cache_format, columns, filters)
+            record.rows = len(df)
+            record.bytes = os.path.getsize(path)
+
+        return df
+
+    def write_cache(self, data, path):
+        """
+        Writes a DataFrame or an iterable of chunks to path.
+        """
+        with stage(self.stats, 'cache_write', file=os.path.basename(path)) as record:
+            if isinstance(data, pd.DataFrame):
+                write_table(data, path, self.cache_format)
+                record.rows = len(data)
+            else:
+                record.rows = write_chunks(data, path, self.cache_format)
+            record.bytes = os.path.getsize(path)
+
+    def format_columns(self, columns):
+        """
+        Returns column names as they appear in the returned data:
+        lowercase if clean, uppercase otherwise.
+        """
+        if columns is None:
+            return None
+
+        return [col.lower() if self.clean else col.upper() for col in columns]
+
+    def format_filters(self, filters):
+        """
+        Returns filters with formatted column names. Values of
+        date columns are converted to timestamps if clean.
+        """
+        if not filters:
+            return None
+
+        formatted = []
+        for col, op, value in filters:
+            col, = self.format_columns([col])
+            if self.clean and col.startswith('fecha'):
+                value = pd.to_datetime(value)
+                if op in ('in', 'not in'):
+                    value = list(value)
+            formatted.append((col, op, value))
+
+        return formatted
+
+    def get_usecols(self, columns, filters=None, preserve_original=None):
+        """
+        Returns the csv columns needed to build columns and evaluate
+        filters. None if every column is needed.
+        """
+        if columns is None:
+            return None
+
+        needed = list(columns) + [col for col, _, _ in filters or []]
+        usecols = [col.upper().replace('_ORIGINAL', '') for col in needed]
+        if self.clean and 'MUNICIPIO_RES' in usecols:
+            usecols.append('ENTIDAD_RES')
+
+        return list(dict.fromkeys(usecols))
+
+    def iter_selected_chunks(self, data_path, catalogo, descripcion,
+                             preserve_original=None, columns=None, filters=None):
+        """
+        Yields the rows of the csv in data_path matching filters, with
+        only columns. If clean, filter columns are decoded first and the
+        remaining columns are only decoded for matching rows.
+        """
+        usecols = self.get_usecols(columns, filters, preserve_original)
+        columns = self.format_columns(columns)
+        filters = self.format_filters(filters)
+
+        column_types = None
+        if catalogo is not None:
+            catalogo_dict, desc_dict = self.compile_dictionary(catalogo, descripcion)
+            column_types = self.get_column_types(catalogo_dict, desc_dict)
+
+        if self.is_streaming():
+            chunks = self.get_encoded_chunks(data_path, usecols, column_types)
+        else:
+            chunks = [self.get_encoded_data(data_path, usecols=usecols, column_types=column_types)]
+
+        for chunk in chunks:
+            if self.clean:
+                if filters:
+                    keys = [col.upper().replace('_ORIGINAL', '') for col, _, _ in filters]
+                    if 'MUNICIPIO_RES' in keys:
+                        keys.append('ENTIDAD_RES')
+                    keys = chunk[list(dict.fromkeys(keys))].copy()
+                    keys = self.decode_data(keys, catalogo_dict, desc_dict, preserve_original)
+                    chunk = chunk[filter_mask(keys, filters).to_numpy()]
+                chunk = self.decode_data(chunk, catalogo_dict, desc_dict, preserve_original)
+            elif filters:
+                chunk = chunk[filter_mask(chunk, filters).to_numpy()]
+
+            if columns is not None:
+                chunk = chunk[columns]
+
+            yield chunk.reset_index(drop=True)
+
+    def get_encoded_data(self, path, encoding='UTF-8', usecols=None, column_types=None):
+        if self.parser == 'pyarrow':
+            return self.get_arrow_data(path, usecols, column_types)
+
         try:
-            data = pd.read_csv(path, encoding=encoding)
+            with stage(self.stats, 'parse', file=os.path.basename(str(path))) as record, \
+                    open_source(path) as f:
+                data = pd.read_csv(f, encoding=encoding, usecols=usecols, dtype=column_types)
+                record.rows = len(data)
+                record.bytes = get_size(path)
         except BaseException as e:
             if isinstance(e, UnicodeDecodeError):
                 encoding = 'ISO-8859-1'
-                data = self.get_encoded_data(path, encoding)
+                data = self.get_encoded_data(path, encoding, usecols, column_types)
             else:
                 raise RuntimeError('Cannot read the data.')
 
         return data
-    
+
+    def get_arrow_data(self, path, usecols=None, column_types=None):
+        """
+        Returns the csv in path parsed with the multi-threaded pyarrow reader.
+        """
+        encoding = self.get_encoding(path)
+        try:
+            with stage(self.stats, 'parse', file=os.path.basename(str(path)), parser='pyarrow') as record:
+                data = self.arrow_to_frame(read_csv_arrow(path, encoding, usecols, column_types))
+                record.rows = len(data)
+                record.bytes = get_size(path)
+        except (OSError, ValueError) as e:
+            raise RuntimeError('Cannot read the data.') from e
+
+        return data
+
+    def arrow_to_frame(self, table):
+        """
+        Returns table as a DataFrame, backed by Arrow memory
+        if dtype_backend is 'pyarrow'.
+        """
+        if self.dtype_backend == 'pyarrow':
+            return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    def get_column_types(self, catalogo_dict, desc_dict):
+        """
+        Returns the type of each csv column derived from the description
+        sheet. Free text columns are always read as strings, so chunks
+        parsed separately do not infer different types for them.
+
+        For the pandas parser only text columns are typed. For the
+        pyarrow parser dates are also read as strings (decoded later)
+        and catalogue keys as integers. Other columns are inferred
+        by the parser.
+        """
+        if self.parser != 'pyarrow':
+            return {col: str for col, formato in desc_dict.items() if formato == TEXT_FORMAT}
+
+        import pyarrow as pa
+
+        column_types = {}
+        for col, formato in desc_dict.items():
+            if 'FECHA' in col or isinstance(formato, dict) or formato == TEXT_FORMAT:
+                column_types[col] = pa.string()
+            elif isinstance(formato, str) and formato in catalogo_dict:
+                column_types[col] = pa.int64()
+
+        return column_types
+
+    def get_encoding(self, path, nrows=SAMPLE_ROWS):
+        """
+        Returns the encoding of the csv in path
+        using its first nrows.
+        """
+        try:
+            with open_source(path) as f:
+                pd.read_csv(f, encoding='UTF-8', nrows=nrows)
+        except UnicodeDecodeError:
+            return 'ISO-8859-1'
+        except BaseException:
+            raise RuntimeError('Cannot read the data.')
+
+        return 'UTF-8'
+
+    def get_chunksize(self, path, encoding):
+        """
+        Returns the number of rows per chunk. If chunksize is not present,
+        it is derived from memory_budget and the memory used by
+        a sample of the csv.
+        """
+        if self.chunksize is not None:
+            return self.chunksize
+
+        with open_source(path) as f:
+            sample = pd.read_csv(f, encoding=encoding, nrows=SAMPLE_ROWS)
+        row_size = sample.memory_usage(index=False, deep=True).sum() / max(len(sample), 1)
+        chunksize = int(self.memory_budget / (row_size * CLEANING_OVERHEAD))
+
+        return max(chunksize, MIN_CHUNKSIZE)
+
+    def get_encoded_chunks(self, path, usecols=None, column_types=None):
+        """
+        Yields chunks of the csv in path, only
+        parsing usecols if present.
+        """
+        encoding = self.get_encoding(path)
+        chunksize = self.get_chunksize(path, encoding)
+        logger.info('Reading chunks of {} rows'.format(chunksize))
+
+        if self.parser == 'pyarrow':
+            tables = iter_csv_arrow(path, chunksize, encoding, usecols, column_types)
+            yield from self.record_chunks((self.arrow_to_frame(table) for table in tables), path)
+            return
+
+        with open_source(path) as f:
+            reader = pd.read_csv(f, encoding=encoding, chunksize=chunksize, usecols=usecols,
+                                 dtype=column_types)
+            yield from self.record_chunks(reader, path)
+
+    def record_chunks(self, reader, path):
+        """
+        Yields the chunks of reader recording a parse stage for each one.
+        """
+        while True:
+            with stage(self.stats, 'parse', file=os.path.basename(str(path)), parser=self.parser) as record:
+                chunk = next(reader, None)
+                record.rows = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+    def iter_clean_chunks(self, data_path, catalogo, descripcion, preserve_original=None):
+        """
+        Yields cleaned chunks of the csv in data_path. The catalogue
+        and description are compiled only once.
+        """
+        catalogo_dict, desc_dict = self.compile_dictionary(catalogo, descripcion)
+        column_types = self.get_column_types(catalogo_dict, desc_dict)
+        chunks = self.get_encoded_chunks(data_path, column_types=column_types)
+
+        yield from self.decode_chunks(chunks, catalogo_dict, desc_dict, preserve_original)
+
+    def iter_data(self, preserve_original=None, columns=None, filters=None):
+        """
+        Yields DGE data in chunks of chunksize rows (or derived from
+        memory_budget), cleaned if clean=True. Only one chunk is
+        held in memory at a time. See get_data for columns and filters.
+        """
+        assert self.is_streaming(), 'Please provide chunksize or memory_budget'
+
+        data_path = self.get_data_file()
+
+        if columns is not None or filters is not None:
+            catalogo, descripcion = self.read_dictionary() if self.clean else (None, None)
+            yield from self.iter_selected_chunks(data_path, catalogo, descripcion,
+                                                 preserve_original, columns, filters)
+            return
+
+        if not self.clean:
+            column_types = self.get_column_types(*self.compile_dictionary(*self.read_dictionary()))
+            yield from self.get_encoded_chunks(data_path, column_types=column_types)
+            return
+
+        catalogo, descripcion = self.read_dictionary()
+
+        yield from self.iter_clean_chunks(data_path, catalogo, descripcion, preserve_original)
+
     def parse_catalogo_data(self, sheet, df):
 
         if sheet in ['Catálogo RESULTADO_LAB', 'Catálogo CLASIFICACION_FINAL']:
@@ -102,35 +550,166 @@ class DGE:
             
         return df
     
-    def read_data(self, encoding='UTF-8'):
+    def get_data_file(self):
+        """
+        Returns the location of the DGE csv, downloading it if needed.
+        """
         if self.date is None:
-            data_path, = download_file(self.data_path, URL_DATA, decompress=True)
+            url = URL_DATA
         else:
             date_f = self.date.strftime('%d.%m.%Y')
-            data_path = URL_HISTORICAL.format(date_f)
+            url = URL_HISTORICAL.format(date_f)
 
-        data = self.get_encoded_data(data_path)
-        
-        _, catalogo_path, desc_path = download_file(self.data_path, URL_DESCRIPTION, decompress=True)
-        
-        catalogo = pd.read_excel(catalogo_path, sheet_name=None)
+        if self.extract:
+            data_path, = download_file(self.data_path, url, decompress=True,
+                                       segments=self.download_segments, stats=self.stats)
+        else:
+            data_path, = zip_members(download_file(self.data_path, url,
+                                                   segments=self.download_segments,
+                                                   stats=self.stats))
+
+        return data_path
+
+    def read_data(self, encoding='UTF-8', data_path=None, dictionary=None):
+        """
+        Returns data, catalogue and description. The dictionary is
+        downloaded and parsed in a background thread while the data
+        is downloaded and parsed, unless a dictionary future is provided.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            if dictionary is None:
+                dictionary = executor.submit(self.read_dictionary)
+
+            if data_path is None:
+                data_path = self.get_data_file()
+
+            # Column types come from the description sheet
+            column_types = self.get_column_types(*self.compile_dictionary(*dictionary.result()))
+
+            data = self.get_encoded_data(data_path, column_types=column_types)
+
+            catalogo_original, desc = dictionary.result()
+
+        return data, catalogo_original, desc
+
+    def wait_dictionary(self, dictionary=None):
+        """
+        Returns catalogue and description from a dictionary
+        future, reading them if it is not present.
+        """
+        if dictionary is None:
+            return self.read_dictionary()
+
+        return dictionary.result()
+
+    def read_dictionary(self):
+        """
+        Returns catalogue and description of the DGE dictionary.
+
+        Parsed sheets and their compilation are cached inside data_path,
+        keyed by the sha256 of the dictionary zip, so the excel files
+        are only parsed when the dictionary changes.
+        """
+        if self.extract:
+            files = download_file(self.data_path, URL_DESCRIPTION, decompress=True, stats=self.stats)
+            files = [file for file in files if file.is_file()]
+        else:
+            files = zip_members(download_file(self.data_path, URL_DESCRIPTION, stats=self.stats))
+
+        dictionary_hash = self.get_dictionary_hash()
+        cache_file = self.get_dictionary_cache_file()
+        with FileLock(cache_file):
+            # One stage per call, cached tells whether the excel files were parsed
+            with stage(self.stats, 'dictionary') as record:
+                cached = self.read_dictionary_cache(dictionary_hash)
+                record.info['cached'] = cached is not None
+                if cached is None:
+                    catalogo_original, desc = self.parse_dictionary(files)
+                    compiled = self.compile_dictionary(catalogo_original, desc)
+                else:
+                    catalogo_original, desc = cached['catalogo'], cached['descripcion']
+                    compiled = cached['compilado']
+            self.compiled_dictionary = catalogo_original, desc, compiled
+
+            if cached is not None:
+                logger.info('Open compiled dictionary ' + cache_file)
+                return catalogo_original, desc
+
+            logger.info('Save compiled dictionary ' + cache_file)
+            with atomic_path(cache_file) as tmp_file:
+                pd.to_pickle({
+                    'version': DICTIONARY_CACHE_VERSION,
+                    'sha256': dictionary_hash,
+                    'catalogo': catalogo_original,
+                    'descripcion': desc,
+                    'compilado': compiled
+                }, tmp_file)
+
+        return catalogo_original, desc
+
+    def get_dictionary_cache_file(self):
+        file_name = os.path.splitext(os.path.split(URL_DESCRIPTION)[1])[0]
+
+        return os.path.join(self.data_path, file_name + '.pickle')
+
+    def get_dictionary_hash(self):
+        """
+        Returns the sha256 of the downloaded dictionary zip, stored
+        by download_file in its sidecar file.
+        """
+        zip_file = os.path.join(self.data_path, os.path.split(URL_DESCRIPTION)[1])
+        dictionary_hash = read_metadata(zip_file + '.json').get('sha256')
+        if dictionary_hash is None:
+            dictionary_hash = file_checksum(zip_file)
+
+        return dictionary_hash
+
+    def read_dictionary_cache(self, dictionary_hash):
+        """
+        Returns the cached dictionary if it was
+        built from dictionary_hash, else None.
+        """
+        cache_file = self.get_dictionary_cache_file()
+        if not os.path.exists(cache_file):
+            return None
+
+        try:
+            cached = pd.read_pickle(cache_file)
+        except BaseException:
+            logger.info('Unable to read {}, rebuilding'.format(cache_file))
+            return None
+
+        if cached.get('version') != DICTIONARY_CACHE_VERSION or \
+                cached.get('sha256') != dictionary_hash:
+            return None
+
+        return cached
+
+    def parse_dictionary(self, files):
+        """
+        Returns catalogue and description parsed
+        from the excel files of the dictionary.
+        """
+        catalogo_path, desc_path = files[-2:]
+
+        with open_source(catalogo_path) as f:
+            catalogo = pd.read_excel(BytesIO(f.read()), sheet_name=None)
         catalogo_original = {
             sheet: self.parse_catalogo_data(sheet, df) \
             for sheet, df in catalogo.items()
         }
 
-        desc = pd.read_excel(desc_path)
+        with open_source(desc_path) as f:
+            desc = pd.read_excel(BytesIO(f.read()))
 
-        return data, catalogo_original, desc
+        return catalogo_original, desc
 
     def get_dict_replace(self, key, df):
         if key == 'ENTIDADES':
             return dict(zip(df['CLAVE_ENTIDAD'], df['ENTIDAD_FEDERATIVA']))
         
         elif key == 'MUNICIPIOS':
-            id_mun = df['CLAVE_ENTIDAD'].astype(int).astype(str) + \
-                     '_' + \
-                     df['CLAVE_MUNICIPIO'].astype(int).astype(str)
+            id_mun = municipality_key(df['CLAVE_ENTIDAD'].astype(int), df['CLAVE_MUNICIPIO'].astype(int))
 
             return dict(zip(id_mun, df['MUNICIPIO']))
         
@@ -147,7 +726,7 @@ class DGE:
                 ' ',
                 '')
         elif 'TEXT' in formato:
-            return None
+            return TEXT_FORMAT
         elif 'TEXTO' in formato and '99' in formato:
             return {'99': 'SE IGNORA'}
         elif 'TEXTO' in formato and '97' in formato:
@@ -174,42 +753,62 @@ class DGE:
     def replace_values(self, data, col_name, desc_dict, catalogo_dict):
         formato = desc_dict[col_name]
         if 'FECHA' in col_name:
-            df = pd.to_datetime(data[col_name], format=formato,
-                                errors='coerce')
-            
-            return df
+            return self.get_date_table(formato).decode(data[col_name])
 
-        if formato is None:
+        if formato is None or formato == TEXT_FORMAT:
             return data[col_name]
 
         if isinstance(formato, dict):
             return data[col_name].replace(formato)
 
-        replacement = catalogo_dict[formato]
-        
-        return data[col_name].replace(replacement)
+        return catalogo_dict[formato].decode(data[col_name])
+
+    def get_date_table(self, formato):
+        """
+        Returns the DateTable of formato, shared by every date
+        column and chunk decoded by this instance.
+        """
+        if formato not in self.date_tables:
+            self.date_tables[formato] = DateTable(formato)
+
+        return self.date_tables[formato]
+
+    def compile_dictionary(self, catalogo, descripcion):
+        """
+        Returns the compiled catalogue and the format of each variable.
+        The compilation loaded by read_dictionary is reused.
+        """
+        compiled = getattr(self, 'compiled_dictionary', None)
+        if compiled is not None and compiled[0] is catalogo and compiled[1] is descripcion:
+            return compiled[2]
 
-    def clean_data(self, df, catalogo, descripcion, preserve_original=None):
         #Using catlogo
         catalogo_dict = {
             key.replace('Catálogo ', '') \
                .replace('de ', ''): df \
             for key, df in catalogo.items()
         }
-        
-        catalogo_dict = {
+
+        catalogo_dict = compile_catalogue({
             key: self.get_dict_replace(key, df) \
             for key, df in catalogo_dict.items()
-        }
+        })
 
         #Cleaning description
         nombre_variable = descripcion['NOMBRE DE VARIABLE'].apply(self.clean_nombre_variable)
-        formato_o_fuente = descripcion['FORMATO O FUENTE'].apply(self.clean_formato_fuente)
+        # Not Series.apply, it turns None formats into NaN on recent pandas
+        formato_o_fuente = [self.clean_formato_fuente(formato) for formato in descripcion['FORMATO O FUENTE']]
         desc_dict = dict(zip(nombre_variable, formato_o_fuente))
 
-        df['MUNICIPIO_RES'] = df['ENTIDAD_RES'].astype(str) + \
-                              '_' + \
-                              df['MUNICIPIO_RES'].astype('Int64').astype(str)
+        return catalogo_dict, desc_dict
+
+    def decode_data(self, df, catalogo_dict, desc_dict, preserve_original=None):
+        """
+        Decodes df using a compiled catalogue and description.
+        """
+        # Municipalities are keyed by integers, ent * 1000 + mun
+        if 'MUNICIPIO_RES' in df:
+            df['MUNICIPIO_RES'] = municipality_key(df['ENTIDAD_RES'], df['MUNICIPIO_RES'])
 
         #Updating cols
         if preserve_original is None:
@@ -220,20 +819,408 @@ class DGE:
                 new_col = col + '_original'
                 df[new_col] = df[col]
 
-            df[col] = self.replace_values(df, col, desc_dict, catalogo_dict)
+            with stage(self.stats, 'decode', column=col) as record:
+                df[col] = self.replace_values(df, col, desc_dict, catalogo_dict)
+                record.rows = len(df)
 
         df.columns = df.columns.str.lower()
 
         return df
 
+    def clean_data(self, df, catalogo, descripcion, preserve_original=None):
+        catalogo_dict, desc_dict = self.compile_dictionary(catalogo, descripcion)
+
+        if self.get_n_workers() > 1 and len(df) >= 2 * MIN_PARTITION_ROWS:
+            return self.decode_parallel(df, catalogo_dict, desc_dict, preserve_original)
+
+        return self.decode_data(df, catalogo_dict, desc_dict, preserve_original)
+
+    def get_n_workers(self):
+        """
+        Returns the number of processes used to clean data.
+        """
+        if self.n_jobs is None:
+            return os.cpu_count() or 1
+
+        return self.n_jobs
+
+    def get_decode_pool(self, catalogo_dict, desc_dict, context=None):
+        """
+        Returns a process pool whose workers receive the
+        compiled catalogue once, when they start.
+        """
+        return ProcessPoolExecutor(max_workers=self.get_n_workers(),
+                                   mp_context=context,
+                                   initializer=_init_worker,
+                                   initargs=(catalogo_dict, desc_dict))
+
+    def decode_parallel(self, df, catalogo_dict, desc_dict, preserve_original=None):
+        """
+        Decodes df (see decode_data) splitting its rows in one
+        partition per worker, at least MIN_PARTITION_ROWS each.
+
+        Forked workers inherit df, so only the bounds of each partition
+        are sent to them. Other start methods receive the partitions.
+        Like decode_data, df is decoded in place and returned.
+        """
+        global _worker_frame
+
+        n_partitions = max(min(self.get_n_workers(), len(df) // MIN_PARTITION_ROWS), 1)
+        bounds = np.linspace(0, len(df), n_partitions + 1).astype(int)
+        partitions = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+        context = multiprocessing.get_context()
+        if context.get_start_method() == 'fork':
+            _worker_frame = df
+        else:
+            partitions = [df.iloc[start:end] for start, end in partitions]
+
+        try:
+            with stage(self.stats, 'decode', partitions=n_partitions) as record:
+                with self.get_decode_pool(catalogo_dict, desc_dict, context) as executor:
+                    decoded = list(executor.map(_decode_partition, partitions, repeat(preserve_original)))
+                decoded = self.concat_partitions(decoded, catalogo_dict, desc_dict)
+                decoded.index = df.index
+                record.rows = len(decoded)
+        finally:
+            _worker_frame = None
+
+        # Same side effects as the serial path
+        df.drop(columns=df.columns, inplace=True)
+        for col in decoded.columns:
+            df[col] = decoded[col]
+
+        return df
+
+    def decode_chunks(self, chunks, catalogo_dict, desc_dict, preserve_original=None):
+        """
+        Yields decoded chunks in order. With several workers, up to
+        two chunks per worker are decoded ahead of the consumer.
+        """
+        n_workers = self.get_n_workers()
+        if n_workers == 1:
+            for chunk in chunks:
+                yield self.decode_data(chunk, catalogo_dict, desc_dict, preserve_original)
+            return
+
+        with self.get_decode_pool(catalogo_dict, desc_dict) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_decode_partition, chunk, preserve_original))
+                if len(pending) >= 2 * n_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def concat_partitions(self, partitions, catalogo_dict, desc_dict):
+        """
+        Concatenates decoded partitions. Categories are ordered as
+        decoding the whole frame orders them: catalogue labels first,
+        then unknown codes sorted.
+        """
+        df = concat_frames(partitions)
+
+        for col in df.columns:
+            formato = desc_dict.get(col.upper())
+            if not isinstance(formato, str) or formato not in catalogo_dict or \
+                    not isinstance(df[col].dtype, pd.CategoricalDtype):
+                continue
+            categories = catalogo_dict[formato].categories
+            extra = sorted(set(df[col].cat.categories) - set(categories))
+            df[col] = df[col].cat.reorder_categories(categories + extra)
+
+        return df
+
+    def get_historical_data(self, start_date, end_date, date_format='%d-%m-%Y',
+                            n_jobs=None, preserve_original=None):
+        """
+        Downloads and cleans the historical publications between start_date
+        and end_date (inclusive) across a process pool. The dictionary is
+        parsed once and shipped to each worker. Every snapshot is written
+        to the cache inside data_path as soon as it finishes.
+
+        Parameters
+        ----------
+        start_date: str
+            First publication date.
+        end_date: str
+            Last publication date.
+        date_format: str
+            Format of supplied dates.
+        n_jobs: int
+            Number of worker processes. Default None (number of cpus).
+        preserve_original: list
+            Columns whose original values will be kept.
+
+        Returns
+        -------
+        Dict of publication date to cleaned cache file.
+        Dates that could not be processed are logged and skipped.
+        """
+        dates = pd.date_range(pd.to_datetime(start_date, format=date_format),
+                              pd.to_datetime(end_date, format=date_format))
+        if len(dates) and dates[0] < HISTORICAL_START:
+            raise Exception('Historical data only available as of 2020-04-12')
+
+        os.makedirs(self.data_path, exist_ok=True)
+
+        catalogo, descripcion = self.read_dictionary()
+        catalogo_dict, desc_dict = self.compile_dictionary(catalogo, descripcion)
+        params = {
+            'data_path': self.data_path,
+            'cache_format': self.cache_format,
+            'chunksize': self.chunksize,
+            'memory_budget': self.memory_budget,
+            'extract': self.extract,
+            'download_segments': self.download_segments,
+            'parser': self.parser,
+            'dtype_backend': self.dtype_backend
+        }
+
+        files = {}
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_init_worker,
+                                 initargs=(catalogo_dict, desc_dict)) as executor:
+            futures = {
+                executor.submit(_cache_snapshot, params, date, preserve_original): date \
+                for date in dates
+            }
+            for future in as_completed(futures):
+                date = futures[future]
+                try:
+                    files[date] = future.result()
+                    logger.info('Snapshot {} saved in {}'.format(date.date(), files[date]))
+                except BaseException as e:
+                    logger.error('Cannot process snapshot {}: {}'.format(date.date(), e))
+
+        return dict(sorted(files.items()))
+
+    def cache_snapshot(self, catalogo_dict, desc_dict, preserve_original=None):
+        """
+        Downloads and cleans the publication of self.date using a compiled
+        dictionary and writes it to the cache. Returns the cache file.
+        """
+        clean_data_file = self.get_clean_data_file()
+        data_file = self.get_data_file()
+
+        if self.is_cached(clean_data_file, data_file, preserve_original):
+            return clean_data_file
+
+        with FileLock(clean_data_file):
+            # Another process may have built it while waiting for the lock
+            if self.is_cached(clean_data_file, data_file, preserve_original):
+                return clean_data_file
+
+            column_types = self.get_column_types(catalogo_dict, desc_dict)
+            if self.is_streaming():
+                chunks = (
+                    self.decode_data(chunk, catalogo_dict, desc_dict, preserve_original) \
+                    for chunk in self.get_encoded_chunks(data_file, column_types=column_types)
+                )
+                self.write_cache(chunks, clean_data_file)
+            else:
+                df = self.get_encoded_data(data_file, column_types=column_types)
+                df = self.decode_data(df, catalogo_dict, desc_dict, preserve_original)
+                self.write_cache(df, clean_data_file)
+
+        return clean_data_file
+
+    def update_changelog(self, path=None, preserve_original=None):
+        """
+        Appends the cleaned publication to a ChangeLog, storing only the
+        records inserted, updated or deleted since the last stored publication.
+
+        Parameters
+        ----------
+        path: str
+            Directory of the change log. Default data_path/changelog.
+        preserve_original: list
+            Columns whose original values will be kept.
+
+        Returns
+        -------
+        Dict with the number of inserted, updated and deleted records.
+        """
+        if path is None:
+            path = os.path.join(self.data_path, 'changelog')
+
+        return_catalogo, return_descripcion = self.return_catalogo, self.return_descripcion
+        self.return_catalogo, self.return_descripcion = False, False
+        try:
+            df = self.get_data(preserve_original=preserve_original)
+        finally:
+            self.return_catalogo, self.return_descripcion = return_catalogo, return_descripcion
+
+        date = self.date
+        if date is None:
+            date = df['fecha_actualizacion'].max() if self.clean else \
+                pd.to_datetime(df['FECHA_ACTUALIZACION']).max()
+
+        changelog = ChangeLog(path, key='id_registro' if self.clean else 'ID_REGISTRO',
+                              ignore=['fecha_actualizacion' if self.clean else 'FECHA_ACTUALIZACION'],
+                              cache_format=self.cache_format)
+
+        return changelog.append(df, date)
+
+    def get_cube_file(self):
+        """
+        Returns the path of the aggregated cube,
+        stored next to the cleaned data cache.
+        """
+        clean_data_file, extension = os.path.splitext(self.get_clean_data_file())
+
+        return clean_data_file + '_cube' + extension
+
+    def get_cube(self):
+        """
+        Returns the DGECube of the publication, building and
+        caching it from the cleaned data only when needed.
+        Concurrent processes build it once (see get_data).
+        """
+        cube_file = self.get_cube_file()
+        data_file = self.get_data_file()
+        with FileLock(cube_file):
+            if self.is_cached(cube_file, data_file):
+                logger.info("Open cube " + cube_file)
+                with stage(self.stats, 'cache_read', file=os.path.basename(cube_file)):
+                    return DGECube.read(cube_file, self.cache_format)
+
+            dge_data = self.get_clean_columns(CUBE_COLUMNS, data_file)
+
+            logger.info("Save cube " + cube_file)
+            with stage(self.stats, 'aggregate') as record:
+                cube = DGECube.from_data(dge_data)
+                record.rows = len(dge_data)
+            self.write_cache(cube.cube, cube_file)
+
+        return cube
+
+    def get_clean_columns(self, columns, data_file=None):
+        """
+        Returns columns of the cleaned data, keeping the original
+        state and municipality keys.
+
+        Selections are not written to the cache (see get_data), so if
+        the cleaned data cache does not exist yet it is built and
+        published first and the columns are projected afterwards.
+        Later calls only read the columns from the cache.
+        """
+        preserve_original = ['MUNICIPIO_RES', 'ENTIDAD_RES']
+        data_file = self.get_data_file() if data_file is None else data_file
+        clean, return_catalogo, return_descripcion = \
+            self.clean, self.return_catalogo, self.return_descripcion
+        self.clean, self.return_catalogo, self.return_descripcion = True, False, False
+        try:
+            if self.is_cached(self.get_clean_data_file(), data_file, preserve_original):
+                return self.get_data(preserve_original=preserve_original, columns=columns)
+
+            df = self.get_data(preserve_original=preserve_original)
+
+            return df[self.format_columns(columns)]
+        finally:
+            self.clean, self.return_catalogo, self.return_descripcion = \
+                clean, return_catalogo, return_descripcion
+
+    def get_series_file(self, date=None):
+        """
+        Returns the path of the epidemic curves of the publication
+        of date (default self.date), stored next to the cleaned data cache.
+        """
+        clean_data_file, extension = os.path.splitext(self.get_clean_data_file(date))
+
+        return clean_data_file + '_series' + extension
+
+    def get_series(self, window=7):
+        """
+        Returns the EpiCurves (daily confirmed cases by symptom onset,
+        deaths by date of death and their rolling averages over window
+        days, per state and municipality) of the publication.
+
+        Curves are cached per publication. When they are built for a
+        new publication, the cached curves of the previous one (the
+        stale current ones, or those of the day before for historical
+        publications) are reused and only the rolling windows including
+        a changed day are recomputed. The first historical publication
+        has no previous one and is built from scratch.
+        """
+        series_file = self.get_series_file()
+        data_file = self.get_data_file()
+        with FileLock(series_file):
+            if self.is_cached(series_file, data_file):
+                curves = EpiCurves.read(series_file, self.cache_format)
+                if curves.window == window:
+                    logger.info("Open series " + series_file)
+                    return curves
+
+            previous = None
+            previous_file = series_file
+            if self.date is not None:
+                previous_date = self.date - pd.Timedelta(days=1)
+                previous_file = self.get_series_file(previous_date) \
+                    if previous_date >= HISTORICAL_START else None
+            if previous_file is not None and os.path.exists(previous_file):
+                logger.info("Update series from " + previous_file)
+                previous = EpiCurves.read(previous_file, self.cache_format)
+
+            dge_data = self.get_clean_columns(SERIES_COLUMNS, data_file)
+
+            with stage(self.stats, 'series') as record:
+                curves = EpiCurves.from_data(dge_data, window, previous)
+                record.rows = len(dge_data)
+            logger.info("Save series " + series_file)
+            self.write_cache(curves.series, series_file)
+
+        return curves
+
     def get_plot(self):
         self.return_catalogo = True
         self.return_descripcion = True
         self.clean = True
 
-        dge_data, catalogue, description = self.get_data(preserve_original=['MUNICIPIO_RES', 'ENTIDAD_RES'])
+        cube = self.get_cube()
+        catalogue, description = self.read_dictionary()
+
+        # Plotting dependencies are only imported when a plot is requested
+        from covidmx.dge_plot import DGEPlot
+
+        geo_cache = GeoCache(os.path.join(self.data_path, 'geo'))
 
-        dge_plot = DGEPlot(dge_data, catalogue, description)
+        dge_plot = DGEPlot(None, catalogue, description, cube=cube,
+                           geo_cache=geo_cache, stats=self.stats)
         dge_plot.date = self.date
 
         return dge_plot
+
+
+_worker_dictionary = None
+
+
+def _init_worker(catalogo_dict, desc_dict):
+    global _worker_dictionary
+    _worker_dictionary = catalogo_dict, desc_dict
+
+
+def _cache_snapshot(params, date, preserve_original=None):
+    dge = DGE(date=date.strftime('%d-%m-%Y'), **params)
+    catalogo_dict, desc_dict = _worker_dictionary
+
+    return dge.cache_snapshot(catalogo_dict, desc_dict, preserve_original)
+
+
+_worker_dge = None
+# Frame inherited by forked workers of decode_parallel
+_worker_frame = None
+
+
+def _decode_partition(partition, preserve_original=None):
+    global _worker_dge
+    # Date tables are kept by the worker across partitions
+    if _worker_dge is None:
+        _worker_dge = DGE(data_path=None)
+    catalogo_dict, desc_dict = _worker_dictionary
+
+    if isinstance(partition, tuple):
+        start, end = partition
+        partition = _worker_frame.iloc[start:end]
+
+    return _worker_dge.decode_data(partition, catalogo_dict, desc_dict, preserve_original)
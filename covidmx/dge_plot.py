@@ -1,59 +1,66 @@
-from mapsmx import MapsMX
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
+from covidmx.cube import STATUS, DGECube, prepare_data
+from covidmx.geometry import GeoCache
+from covidmx.stats import stage
+
+# Default arguments of the choropleth layer of every map
+PLOT_KWARGS = {
+    'cmap': 'Reds',
+    'scheme': 'quantiles',
+    'k': 4,
+    'legend': True,
+    'zorder': 1,
+    'missing_kwds': {'color': 'lightgray', 'label': 'Sin info'}
+}
+
 
 class DGEPlot:
     """
     Class to plot dge information
     """
 
-    def __init__(self, dge_data, catalogue, description):
+    def __init__(self, dge_data, catalogue, description, cube=None, geo_cache=None,
+                 stats=None):
 
-        self.dge_data = self.prepare_data(dge_data)
-        self.dge_data['cve_ent'] = self.dge_data['cve_ent'].astype(int).astype(str)
+        self.stats = stats
+        self._dge_data = dge_data
+        if cube is None:
+            cube = DGECube.from_data(dge_data)
+        self.cube = cube
         self.catalogue = catalogue
         self.description = description
+        self.date = None
 
-        #Downloading geo information
-        state_geo = MapsMX().get_geo('state')
-        state_geo['cve_ent'] = state_geo['cve_ent'].astype(int).astype(str)
+        #Geo information with join keys
+        if geo_cache is None:
+            geo_cache = GeoCache()
+        self.geo_cache = geo_cache
 
-        mun_geo = MapsMX().get_geo('municipality')
-        mun_geo[['cve_ent', 'cve_mun']] = mun_geo[['cve_ent', 'cve_mun']].astype(int).astype(str)
-        mun_geo['cve_mun'] = mun_geo['cve_ent'] + '_' + mun_geo['cve_mun']
+        self.state_geo = self.geo_cache.get('state')
+        self.mun_geo = self.geo_cache.get('municipality')
+        self.available_states = self.cube.available_states
+        self.available_status = list(STATUS)
 
+    @property
+    def dge_data(self):
+        """
+        Prepared records (see prepare_data) DGEPlot was built from,
+        kept for compatibility. Maps are drawn from the cube, so it is
+        None if DGEPlot was built from a cube (e.g. by DGE.get_plot).
+        """
+        if self._dge_data is None:
+            return None
 
-        self.state_geo = state_geo
-        self.mun_geo = mun_geo
-        self.available_states = self.dge_data['entidad_res'].unique()
-        self.available_status = ['confirmados', 'negativos', 'sospechosos', 'muertos']
+        return self.prepare_data(self._dge_data)
 
     def prepare_data(self, df):
 
-        df = df.rename(columns={
-                       'entidad_res_original': 'cve_ent',
-                       'municipio_res_original': 'cve_mun'
-                       })
-
-        df['muertos'] = df['fecha_def'].notna().astype(int)
-
-        replace_resultado = {'Positivo SARS-CoV-2': 'confirmados',
-                             'No positivo SARS-CoV-2': 'negativos',
-                             'Resultado pendiente':'sospechosos'}
-
-        df['resultado'] = df['resultado'].replace(replace_resultado)
-        df = pd.concat([df, pd.get_dummies(df['resultado'])], axis=1)
-
-        int_vars = list(replace_resultado.values()) + ['muertos']
-        df[int_vars] = df[int_vars].astype(int)
-
-        return df
+        return prepare_data(df)
 
     def plot_map(self, status='confirmados', state=None,
                  add_municipalities=False, save_file_name = None,
-                 cmap='Reds',
-                 scheme='quantiles', k=4, legend=True, zorder=1,
-                 missing_kwds={'color': 'lightgray', 'label': 'Sin info'}, **kwargs):
+                 tolerance=None, **kwargs):
         """
         Plot geography information
 
@@ -65,11 +72,15 @@ class DGEPlot:
             Plot particular state.
         add_municipalities: bool
             Wheter add municipalities to plot
+        tolerance: float
+            Simplify geometries with this tolerance (in meters) before plotting.
+            Simplified geometries are cached. Default None (original geometries).
+        kwargs:
+            Arguments of GeoDataFrame.plot for the choropleth layer,
+            defaults in PLOT_KWARGS.
         """
 
-        assert status in self.available_status, 'Please provide some of the following status: {}'.format(', '.join(self.available_status))
-        if state is not None:
-            assert state in self.available_states, 'Please provide some of the following states: {}'.format(', '.join(self.available_states))
+        self.check_spec(status, state)
 
         # if last_date_to_consider is not None:
         #     last_date = pd.to_datetime(last_date_to_consider, format=format_date)
@@ -77,24 +88,140 @@ class DGEPlot:
         # else:
         #     plot_data = self.dge_data
 
+        with stage(self.stats, 'plot_aggregation', state=state):
+            plot_data, state_geo_plot, mun_geo_plot = self.get_plot_data(status, state,
+                                                                         add_municipalities,
+                                                                         tolerance)
+
+        with stage(self.stats, 'plot_render', state=state):
+            base = self.plot_base(state_geo_plot, mun_geo_plot, state, add_municipalities)
+
+            plot_obj = plot_data.plot(ax=base,
+                                      column=status,
+                                      **{**PLOT_KWARGS, **kwargs})
+
+            plt.title(self.get_title(status, state), fontsize=20)
+
+
+            if save_file_name is not None:
+                plt.savefig(save_file_name, bbox_inches='tight', pad_inches=0)
+                plt.close()
+        if save_file_name is None:
+            plt.show()
+
+
+        return plot_obj
+
+    def plot_maps(self, specs, n_jobs=None, **kwargs):
+        """
+        Renders several maps to files.
+
+        Maps of the same state, municipality flag and tolerance share the
+        aggregation and the boundary layers, so only the choropleth layer
+        is drawn for each status. Groups are rendered across a process
+        pool using a non-interactive backend.
+
+        Parameters
+        ----------
+        specs: list
+            Dicts with arguments of plot_map. Each one must
+            include save_file_name.
+        n_jobs: int
+            Number of processes. Default None (number of cpus).
+            Use 1 to render in this process. Stages of groups
+            rendered by worker processes are not recorded in stats.
+        kwargs:
+            Default arguments of plot_map for every spec.
+
+        Returns
+        -------
+        List of rendered files in the order of specs.
+        """
+        specs = [{**kwargs, **spec} for spec in specs]
+
+        groups = {}
+        for spec in specs:
+            assert spec.get('save_file_name') is not None, 'Please provide save_file_name for each map'
+            self.check_spec(spec.get('status', 'confirmados'), spec.get('state'))
+            key = (spec.get('state'), spec.get('add_municipalities', False), spec.get('tolerance'))
+            groups.setdefault(key, []).append(spec)
+
+        groups = list(groups.values())
+        if n_jobs == 1:
+            for group in groups:
+                self.render_group(group)
+        else:
+            with ProcessPoolExecutor(n_jobs,
+                                     initializer=_init_worker,
+                                     initargs=(self.cube, self.geo_cache.path, self.date)) as executor:
+                list(executor.map(_render_group, groups))
+
+        return [spec['save_file_name'] for spec in specs]
+
+    def render_group(self, specs):
+        """
+        Renders specs sharing state, add_municipalities and tolerance
+        on a single figure.
+        """
+        state = specs[0].get('state')
+        add_municipalities = specs[0].get('add_municipalities', False)
+        tolerance = specs[0].get('tolerance')
+
+        with stage(self.stats, 'plot_aggregation', state=state):
+            plot_data, state_geo_plot, mun_geo_plot = self.get_plot_data(STATUS, state,
+                                                                         add_municipalities,
+                                                                         tolerance)
+
+        with stage(self.stats, 'plot_render', state=state, maps=len(specs)):
+            base = self.plot_base(state_geo_plot, mun_geo_plot, state, add_municipalities)
+            n_collections = len(base.collections)
+
+            for spec in specs:
+                spec = dict(spec)
+                status = spec.pop('status', 'confirmados')
+                save_file_name = spec.pop('save_file_name')
+                for arg in ['state', 'add_municipalities', 'tolerance']:
+                    spec.pop(arg, None)
+                spec = {**PLOT_KWARGS, **spec}
+
+                plot_data.plot(ax=base, column=status, **spec)
+                base.set_title(self.get_title(status, state), fontsize=20)
+                base.figure.savefig(save_file_name, bbox_inches='tight', pad_inches=0)
+
+                # Remove the choropleth layer and keep boundaries for the next status
+                for collection in base.collections[n_collections:]:
+                    collection.remove()
+                if base.get_legend() is not None:
+                    base.get_legend().remove()
+
+            plt.close(base.figure)
+
+    def check_spec(self, status, state):
+
+        assert status in self.available_status, 'Please provide some of the following status: {}'.format(', '.join(self.available_status))
+        if state is not None:
+            assert state in self.available_states, 'Please provide some of the following states: {}'.format(', '.join(self.available_states))
+
+    def get_plot_data(self, status, state=None, add_municipalities=False, tolerance=None):
+        """
+        Returns counts of status joined with their geometries and the
+        state and municipality geometries of the map.
+        """
+
         group_cols = ['entidad_res', 'cve_ent']
 
         if add_municipalities:
             group_cols += ['municipio_res', 'cve_mun']
 
-        needed_cols = [status] + group_cols
-
-        plot_data = self.dge_data[needed_cols]
-        state_geo_plot = self.state_geo
-        mun_geo_plot = self.mun_geo
+        plot_data = self.cube.query(status, by=group_cols, state=state)
+        plot_data['cve_ent'] = plot_data['cve_ent'].astype('int64')
+        state_geo_plot = self.geo_cache.get('state', tolerance)
+        mun_geo_plot = self.geo_cache.get('municipality', tolerance)
 
         if state is not None:
-            plot_data = plot_data[plot_data['entidad_res'].str.lower() == state.lower()]
-            cve_ent = str(plot_data['cve_ent'].unique()[0])
-            state_geo_plot = self.state_geo[self.state_geo['cve_ent']==cve_ent]
-            mun_geo_plot = self.mun_geo[self.mun_geo['cve_ent']==cve_ent]
-
-        plot_data = plot_data.groupby(group_cols).agg(sum).reset_index()
+            cve_ent = plot_data['cve_ent'].iloc[0]
+            state_geo_plot = self.geo_cache.get_state('state', cve_ent, tolerance)
+            mun_geo_plot = self.geo_cache.get_state('municipality', cve_ent, tolerance)
 
         if add_municipalities:
             plot_data = plot_data.drop(columns='cve_ent')
@@ -105,6 +232,10 @@ class DGEPlot:
             plot_data = state_geo_plot.merge(plot_data, how='left', on='cve_ent')
             geometry = 'geometry_ent'
 
+        return plot_data.set_geometry(geometry), state_geo_plot, mun_geo_plot
+
+    def plot_base(self, state_geo_plot, mun_geo_plot, state=None, add_municipalities=False):
+
         base = state_geo_plot.boundary.plot(color=None,
                                             edgecolor='black',
                                             linewidth=0.6,
@@ -115,17 +246,12 @@ class DGEPlot:
                                        edgecolor='black',
                                        linewidth=0.2)
 
-        plot_obj = plot_data.set_geometry(geometry).plot(ax=base,
-                                                         column=status,
-                                                         cmap=cmap,
-                                                         scheme=scheme,
-                                                         k=k,
-                                                         legend=legend,
-                                                         zorder=zorder,
-                                                         missing_kwds=missing_kwds,
-                                                         **kwargs)
         base.set_axis_off()
-        plt.axis('equal')
+        base.axis('equal')
+
+        return base
+
+    def get_title(self, status, state=None):
 
         title = 'Casos ' + status + ' por COVID-19'
 
@@ -135,22 +261,25 @@ class DGEPlot:
 
         act_date = self.date
         if self.date is None:
-            act_date = self.dge_data['fecha_actualizacion'][0]
+            act_date = self.cube.update_date
         act_date = act_date.date()
         act_date = str(act_date)
 
         title += '\n'
         title += 'Fecha de actualizacion de los datos: {}'.format(act_date)
 
+        return title
 
-        plt.title(title, fontsize=20)
 
+_worker_plot = None
 
-        if save_file_name is not None:
-            plt.savefig(save_file_name, bbox_inches='tight', pad_inches=0)
-            plt.close()
-        else:
-            plt.show()
 
+def _init_worker(cube, geo_path, date):
+    global _worker_plot
+    plt.switch_backend('Agg')
+    _worker_plot = DGEPlot(None, None, None, cube=cube, geo_cache=GeoCache(geo_path))
+    _worker_plot.date = date
 
-        return plot_obj
+
+def _render_group(specs):
+    _worker_plot.render_group(specs)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+import hashlib
+import logging
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MIN_BLOCK_SIZE = 64 * 1024
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+# Buffers grow while a full block is read faster than this (seconds)
+TARGET_BLOCK_TIME = 0.05
+# Files smaller than this are not split in segments
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+
+_sessions = {}
+
+
+def get_session(pool_size: int = 10) -> requests.Session:
+    """Returns a shared session whose connection pool
+    holds pool_size connections per host.
+    """
+    if pool_size not in _sessions:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _sessions[pool_size] = session
+
+    return _sessions[pool_size]
+
+
+def copy_stream(raw, f: BinaryIO, progress=None) -> int:
+    """Copies the body of a streamed response into f.
+    The buffer starts at MIN_BLOCK_SIZE and doubles (up to MAX_BLOCK_SIZE)
+    while full blocks arrive faster than TARGET_BLOCK_TIME.
+
+    Parameters
+    ----------
+    raw: urllib3.response.HTTPResponse
+        Raw stream of a requests response (stream=True).
+    f: file
+        Binary file opened for writing.
+    progress: tqdm
+        Optional progress bar.
+
+    Returns
+    -------
+    Number of bytes written.
+    """
+    block_size = MIN_BLOCK_SIZE
+    n_bytes = 0
+    while True:
+        start = time.perf_counter()
+        data = raw.read(block_size, decode_content=True)
+        if not data:
+            break
+        f.write(data)
+        n_bytes += len(data)
+        if progress is not None:
+            progress.update(len(data))
+
+        if len(data) == block_size and time.perf_counter() - start < TARGET_BLOCK_TIME:
+            block_size = min(2 * block_size, MAX_BLOCK_SIZE)
+
+    return n_bytes
+
+
+def split_ranges(total_size: int, n_segments: int) -> list:
+    """Splits total_size bytes in n_segments inclusive (start, end) ranges."""
+    n_segments = max(1, min(n_segments, total_size // MIN_SEGMENT_SIZE))
+    bounds = [total_size * i // n_segments for i in range(n_segments + 1)]
+
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(n_segments)]
+
+
+def fetch_segments(url: str, filepath: Union[str, Path], total_size: int,
+                   n_segments: int, validator: Optional[str] = None,
+                   progress=None) -> int:
+    """Downloads url into filepath with parallel range requests.
+
+    Parameters
+    ----------
+    url: str
+        URL to download.
+    filepath: str, Path
+        Destination file, preallocated to total_size.
+    total_size: int
+        Size in bytes of the remote file.
+    n_segments: int
+        Number of parallel range requests.
+    validator: str
+        ETag or Last-Modified sent as If-Range so every segment
+        comes from the same version of the file.
+    progress: tqdm
+        Optional progress bar.
+
+    Returns
+    -------
+    Number of bytes written.
+    """
+    ranges = split_ranges(total_size, n_segments)
+    session = get_session(len(ranges))
+
+    with open(filepath, 'wb') as f:
+        f.truncate(total_size)
+
+    def fetch(byte_range):
+        start, end = byte_range
+        headers = {'Range': f'bytes={start}-{end}'}
+        if validator is not None:
+            headers['If-Range'] = validator
+        with session.get(url, headers=headers, stream=True) as r:
+            if r.status_code != 206:
+                raise RuntimeError(f'Range request not honored for {url}')
+            with open(filepath, 'r+b') as f:
+                f.seek(start)
+                n_bytes = copy_stream(r.raw, f, progress)
+        if n_bytes != end - start + 1:
+            raise RuntimeError(f'Incomplete segment {start}-{end} of {url}')
+
+        return n_bytes
+
+    with ThreadPoolExecutor(len(ranges)) as executor:
+        return sum(executor.map(fetch, ranges))
+
+
+def file_checksum(filepath: Union[str, Path], algorithm: str = 'sha256') -> str:
+    """Returns the hex digest of filepath."""
+    digest = hashlib.new(algorithm)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(MAX_BLOCK_SIZE), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def log_throughput(filename: str, n_bytes: int, elapsed: float) -> float:
+    """Logs and returns the throughput of a download in MB/s."""
+    throughput = n_bytes / max(elapsed, 1e-9) / 1e6
+    logger.info(f'Transferred {n_bytes} bytes of {filename} in {elapsed:.2f}s ({throughput:.1f} MB/s).')
+
+    return throughput
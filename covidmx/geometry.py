@@ -0,0 +1,156 @@
+import logging
+import os
+
+from covidmx.decoder import municipality_key
+from covidmx.locking import atomic_path
+from covidmx.utils import read_metadata, write_metadata
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KINDS = {'state': 'ent', 'municipality': 'mun'}
+# Bump when the cached columns change
+GEOMETRY_CACHE_VERSION = 2
+
+_geometries = {}
+
+
+def build_geometry(kind):
+    """
+    Returns the geometries of kind from mapsmx with the join keys
+    used by DGEPlot: cve_ent as int and cve_mun as the integer
+    municipality key (see decoder.municipality_key).
+    """
+    from mapsmx import MapsMX
+
+    geo = MapsMX().get_geo(kind)
+    geo['cve_ent'] = geo['cve_ent'].astype(int)
+
+    if kind == 'municipality':
+        geo['cve_mun'] = municipality_key(geo['cve_ent'], geo['cve_mun'].astype(int))
+
+    return geo.sort_values('cve_ent', kind='stable').reset_index(drop=True)
+
+
+def source_version():
+    """
+    Returns the version of mapsmx geometries; cached
+    geometries are rebuilt when it changes.
+    """
+    import mapsmx
+
+    return getattr(mapsmx, '__version__', None) or os.path.getmtime(mapsmx.__file__)
+
+
+class GeoCache:
+    """
+    On-disk cache of state and municipality geometries with
+    precomputed join keys, simplified versions and a per-state index.
+
+    Geometries are stored as GeoParquet inside path; requires pyarrow.
+    Loaded geometries are also kept in memory, so several DGEPlot
+    instances share them.
+
+    Parameters
+    ----------
+    path: str
+        Directory of the cache. Default None (only keep geometries in memory).
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    def get(self, kind, tolerance=None):
+        """
+        Returns the geometries of kind.
+
+        Parameters
+        ----------
+        kind: str
+            One of state, municipality.
+        tolerance: float
+            Simplify geometries with this tolerance (in meters).
+            Default None (original geometries).
+        """
+        return self.load(kind, tolerance)[0]
+
+    def get_state(self, kind, cve_ent, tolerance=None):
+        """
+        Returns the geometries of kind inside state cve_ent
+        using the per-state index.
+        """
+        geo, index = self.load(kind, tolerance)
+
+        return geo.iloc[index[int(cve_ent)]]
+
+    def load(self, kind, tolerance=None):
+        """
+        Returns geometries of kind and its per-state index
+        (cve_ent to row positions), building them if needed.
+        """
+        assert kind in KINDS, 'kind must be one of {}'.format(', '.join(KINDS))
+
+        key = (self.path, kind, tolerance)
+        if key not in _geometries:
+            geo = self.read(kind, tolerance)
+            if geo is None:
+                geo = self.build(kind, tolerance)
+            _geometries[key] = geo, geo.groupby('cve_ent', sort=False).indices
+
+        return _geometries[key]
+
+    def build(self, kind, tolerance=None):
+        if tolerance is None:
+            geo = build_geometry(kind)
+        else:
+            geo = self.get(kind).copy()
+            geo = geo.set_geometry(geo.geometry.simplify(tolerance))
+
+        self.write(geo, kind, tolerance)
+
+        return geo
+
+    def read(self, kind, tolerance=None):
+        if self.path is None:
+            return None
+
+        geo_file = self.get_file(kind, tolerance)
+        metadata = read_metadata(geo_file + '.json')
+        if not os.path.exists(geo_file) or metadata.get('version') != source_version() \
+                or metadata.get('cache_version') != GEOMETRY_CACHE_VERSION:
+            return None
+
+        try:
+            import geopandas as gpd
+            return gpd.read_parquet(geo_file)
+        except (ImportError, ValueError, OSError):
+            logger.info('Unable to read {}, rebuilding'.format(geo_file))
+            return None
+
+    def write(self, geo, kind, tolerance=None):
+        if self.path is None:
+            return
+
+        geo_file = self.get_file(kind, tolerance)
+        try:
+            with atomic_path(geo_file) as tmp_file:
+                geo.to_parquet(tmp_file)
+        except ImportError:
+            logger.info('pyarrow is not installed, geometries are not cached')
+            return
+
+        write_metadata(geo_file + '.json', {
+            'version': source_version(),
+            'cache_version': GEOMETRY_CACHE_VERSION,
+            'tolerance': tolerance
+        })
+
+    def get_file(self, kind, tolerance=None):
+        name = KINDS[kind]
+        if tolerance is not None:
+            name += '_{:g}'.format(tolerance)
+
+        return os.path.join(self.path, name + '.parquet')
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Union
+import logging
+import os
+import time
+import uuid
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts to take a busy lock
+POLL_INTERVAL = 0.1
+
+try:
+    import fcntl
+
+    def _try_lock(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+except ImportError:
+    import msvcrt
+
+    def _try_lock(fd: int) -> None:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    def _unlock(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """Exclusive advisory lock on path, shared by processes (and threads)
+    using the same data directory. The lock is held on path + '.lock',
+    which is left in place after release.
+
+    Parameters
+    ----------
+    path: str, Path
+        File guarded by the lock.
+    timeout: float
+        Seconds to wait for the lock before raising TimeoutError.
+        Default None (wait forever).
+    """
+
+    def __init__(self, path: Union[str, Path], timeout: Optional[float] = None):
+        self.path = Path(path)
+        self.lock_file = self.path.with_name(self.path.name + '.lock')
+        self.timeout = timeout
+        self.waited = False
+        self.fd = None
+
+    def acquire(self) -> 'FileLock':
+        """Blocks until the lock is taken. Sets waited if
+        the lock was held by someone else.
+        """
+        self.lock_file.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o666)
+        start = time.monotonic()
+        self.waited = False
+        while True:
+            try:
+                _try_lock(fd)
+                break
+            except OSError:
+                if self.timeout is not None and time.monotonic() - start >= self.timeout:
+                    os.close(fd)
+                    raise TimeoutError(f'Timeout waiting for the lock of {self.path}.')
+                if not self.waited:
+                    logger.info(f'Waiting for {self.path.name}, in use by another process.')
+                    self.waited = True
+                time.sleep(POLL_INTERVAL)
+        self.fd = fd
+
+        return self
+
+    def release(self) -> None:
+        if self.fd is not None:
+            _unlock(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self) -> 'FileLock':
+        return self.acquire()
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+@contextmanager
+def atomic_path(path: Union[str, Path]) -> Iterator[Path]:
+    """Yields a temporary path next to path. When the block finishes the
+    temporary file replaces path in a single rename, so readers see either
+    the previous file or the complete new one. On errors the temporary
+    file is removed and path is left untouched.
+
+    Parameters
+    ----------
+    path: str, Path
+        Destination file.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp')
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+        raise
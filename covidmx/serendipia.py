@@ -1,9 +1,14 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import requests
 from itertools import product
-from unidecode import unidecode
-from covidmx.utils import translate_serendipia
+from covidmx.downloader import get_session
+from covidmx.utils import download_file, read_metadata, translate_serendipia
 pd.options.mode.chained_assignment = None
 
+URL_SERENDIPIA = 'https://serendipia.digital/wp-content/uploads/{}/{}/'
+
 
 class Serendipia:
 
@@ -13,14 +18,19 @@ class Serendipia:
             kind=None,
             clean=True,
             add_search_date=True,
-            date_format='%d-%m-%Y'):
+            date_format='%d-%m-%Y',
+            start_date=None,
+            end_date=None,
+            data_path='data',
+            n_jobs=None):
         """
         Returns COVID19 data from serendipia.
 
         Parameters
         ----------
         date: str or list
-            Date to consider. If not present returns last found data.
+            Date or dates to consider. If not present (and no range is given)
+            returns last found data.
         kind: str
             Kind of data. Allowed: 'confirmados', 'sospechosos'. If not present returns both.
         clean: boolean
@@ -29,19 +39,46 @@ class Serendipia:
             If add date to the DFs.
         date_format: str
             date format if needed
+        start_date: str
+            First date of a range of dates to consider (inclusive).
+            Dates of the range without published data are skipped.
+        end_date: str
+            Last date of the range. Default today.
+        data_path: str
+            Directory where each downloaded csv is cached. Files already
+            downloaded are read from here without network requests.
+        n_jobs: int
+            Number of threads used to probe dates and download files.
+            Default None (see concurrent.futures.ThreadPoolExecutor).
         """
 
         self.allowed_kinds = translate_serendipia
 
-        if not (isinstance(date, str) or date is None):
-            raise ValueError('date must be string')
+        if not (isinstance(date, (str, list)) or date is None):
+            raise ValueError('date must be string or list')
+
+        if date is not None and start_date is not None:
+            raise ValueError('date and start_date cannot be used together')
 
         if not (isinstance(kind, str) or kind is None):
             raise ValueError('kind must be string')
 
         self.date = date
+        self.skip_missing = False
+
+        if start_date is not None:
+            end_date = pd.to_datetime('today') if end_date is None \
+                else pd.to_datetime(end_date, format=date_format)
+            dates = pd.date_range(pd.to_datetime(start_date, format=date_format),
+                                  end_date.normalize())
+            self.dates = [dt.strftime(date_format) for dt in dates]
+            self.skip_missing = True
+        elif isinstance(date, list):
+            self.dates = date
+        else:
+            self.dates = [date]
 
-        if not self.date:
+        if not self.date and start_date is None:
             self.search_date = True
         else:
             self.search_date = False
@@ -57,14 +94,19 @@ class Serendipia:
         self.clean = clean
         self.add_search_date = add_search_date
         self.date_format = date_format
+        self.data_path = os.path.join(data_path, 'serendipia')
+        self.n_jobs = n_jobs
 
     def get_data(self):
 
         print('Reading data')
-        dfs = [
-            self.read_data(
-                dt, ki) for dt, ki in product(
-                [self.date], self.kind)]
+        with ThreadPoolExecutor(self.n_jobs) as executor:
+            dfs = list(executor.map(lambda args: self.read_data(*args),
+                                    product(self.dates, self.kind)))
+
+        dfs = [df for df in dfs if df is not None]
+        if not dfs:
+            raise RuntimeError('No data found between {} and {}'.format(self.dates[0], self.dates[-1]))
 
         if self.clean:
             print('Cleaning data')
@@ -84,40 +126,92 @@ class Serendipia:
 
             return df
 
-        url = self.get_url(date, kind)
-
         try:
-            df = pd.read_csv(url)
-
-            if self.add_search_date:
-                df.loc[:, 'fecha_busqueda'] = date
-
-            return df
-        except BaseException:
+            df = pd.read_csv(self.fetch_file(date, kind))
+        except (requests.RequestException, OSError) as e:
+            if self.skip_missing:
+                print('No information for {} and {}, skipping'.format(kind, date))
+                return None
             raise RuntimeError(
                 'Cannot read the data. Maybe theres no information for {} and {}'.format(
-                    kind, date))
+                    kind, date)) from e
+
+        if self.add_search_date:
+            df.loc[:, 'fecha_busqueda'] = date
+
+        return df
 
     def search_data(self, max_times, kind):
+        """
+        Returns the data of the latest date (among the last max_times days)
+        with published data of kind and the date found.
+        Dates are probed concurrently with HEAD requests.
+        """
         print('Searching last date available for {}...'.format(kind))
 
         search_dates = pd.date_range(
             end=pd.to_datetime('today'),
             periods=max_times)[::-1]
+        search_dates = [date.strftime(self.date_format) for date in search_dates]
 
-        for date in search_dates:
-            date_formatted = date.strftime(self.date_format)
-            url = self.get_url(date_formatted, kind)
-            try:
-                df = pd.read_csv(url)
-                print('Last date available: {}'.format(date_formatted))
-                return df, date_formatted
-            except BaseException:
-                continue
+        with ThreadPoolExecutor(self.n_jobs) as executor:
+            available = list(executor.map(lambda date: self.probe(date, kind), search_dates))
+
+        for date, is_available in zip(search_dates, available):
+            if is_available:
+                print('Last date available: {}'.format(date))
+                return pd.read_csv(self.fetch_file(date, kind)), date
 
         raise RuntimeError('No date found for {}'.format(kind))
 
+    def probe(self, date, kind):
+        """
+        Returns whether the file of date and kind is cached or published.
+        Uses a HEAD request, or a one byte ranged GET if HEAD is not allowed.
+        """
+        if self.is_cached(date, kind):
+            return True
+
+        url = self.get_url(date, kind)
+        session = get_session()
+        try:
+            r = session.head(url, allow_redirects=True, timeout=30)
+            if r.status_code in [405, 501]:
+                r = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=30)
+                r.close()
+        except requests.RequestException:
+            return False
+
+        return r.status_code in [200, 206]
+
+    def get_cache_file(self, date, kind):
+        """
+        Returns the local file of date and kind inside data_path.
+        """
+        return os.path.join(self.data_path, self.get_url(date, kind).split('/')[-1])
+
+    def is_cached(self, date, kind):
+        """
+        Returns whether the file of date and kind was completely downloaded.
+        """
+        cache_file = self.get_cache_file(date, kind)
+
+        return read_metadata(cache_file + '.json').get('complete', False) \
+            and os.path.exists(cache_file)
+
+    def fetch_file(self, date, kind):
+        """
+        Returns the local file of date and kind, downloading it only
+        if it is not cached. Published files do not change, so cached
+        ones are used without revalidation.
+        """
+        if self.is_cached(date, kind):
+            return self.get_cache_file(date, kind)
+
+        return download_file(self.data_path, self.get_url(date, kind))
+
     def clean_data(self, df):
+        from unidecode import unidecode
 
         df.columns = df.columns.str.lower().str.replace(
             ' |-|\n', '_').str.replace('°', '').map(unidecode)
@@ -130,11 +224,11 @@ class Serendipia:
             df = df[~df['n_caso'].str.contains('Fuente|Corte')]
 
         # converting to datetime format
-        df.loc[:, 'fecha_busqueda'] = pd.to_datetime(
+        df['fecha_busqueda'] = pd.to_datetime(
             df['fecha_busqueda'], format=self.date_format)
 
         if [i for i in list(df.columns) if i.startswith('fecha_de_inicio')]:
-            df.loc[:, 'fecha_de_inicio_de_sintomas'] = pd.to_datetime(
+            df['fecha_de_inicio_de_sintomas'] = pd.to_datetime(
                 df['fecha_de_inicio_de_sintomas'], format='%d/%m/%Y')
 
         return df
@@ -155,21 +249,21 @@ class Serendipia:
         month = date_ts.strftime('%m')
         date_f = date_ts.strftime('%Y.%m.%d')
 
-        serendipia_change = pd.to_datetime('19-04-2020', format=self.date_format)
+        serendipia_change = pd.to_datetime('2020-04-19')
 
         spec_kind = self.allowed_kinds[kind]
 
         if spec_kind == 'positivos':
             if date_ts >= serendipia_change:
                 date_f = date_ts.strftime('%d%m%Y')
-                url = 'https://serendipia.digital/wp-content/uploads/{}/{}/covid-19-mexico-{}.csv'.format(year, month, date_f)
+                url = URL_SERENDIPIA.format(year, month) + 'covid-19-mexico-{}.csv'.format(date_f)
             else:
-                url = 'https://serendipia.digital/wp-content/uploads/{}/{}/Tabla_casos_{}_COVID-19_resultado_InDRE_{}-Table-1.csv'.format(year, month, spec_kind, date_f)
+                url = URL_SERENDIPIA.format(year, month) + 'Tabla_casos_{}_COVID-19_resultado_InDRE_{}-Table-1.csv'.format(spec_kind, date_f)
         else:
             if date_ts >= serendipia_change:
                 date_f = date_ts.strftime('%d%m%Y')
-                url = 'https://serendipia.digital/wp-content/uploads/{}/{}/covid-19-mexico-{}-{}.csv'.format(year, month, spec_kind, date_f)
+                url = URL_SERENDIPIA.format(year, month) + 'covid-19-mexico-{}-{}.csv'.format(spec_kind, date_f)
             else:
-                url = 'https://serendipia.digital/wp-content/uploads/{}/{}/Tabla_casos_{}_COVID-19_{}-Table-1.csv'.format(year, month, spec_kind, date_f)
+                url = URL_SERENDIPIA.format(year, month) + 'Tabla_casos_{}_COVID-19_{}-Table-1.csv'.format(spec_kind, date_f)
 
         return url
@@ -0,0 +1,274 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from covidmx.cube import status_indicators
+from covidmx.decoder import MUNICIPALITY_FACTOR, parse_municipality_label
+from covidmx.utils import read_table, write_table
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Date column binning each series
+SERIES = {'confirmados': 'fecha_sintomas', 'muertos': 'fecha_def'}
+# Label and key columns of each level
+LEVELS = {
+    'estado': ('entidad_res', 'entidad_res_original'),
+    'municipio': ('municipio_res', 'municipio_res_original')
+}
+WINDOW = 7
+# Columns of cleaned data needed to build the series
+SERIES_COLUMNS = ['entidad_res', 'entidad_res_original', 'municipio_res',
+                  'municipio_res_original', 'resultado', 'fecha_sintomas',
+                  'fecha_def', 'fecha_actualizacion']
+
+
+def day_offsets(dates, origin):
+    """
+    Returns the integer day offset of each date from origin,
+    -1 for missing dates.
+    """
+    dates = pd.DatetimeIndex(dates)
+    offsets = np.full(len(dates), -1, dtype=np.int64)
+    valid = ~dates.isna()
+    offsets[valid] = (dates[valid] - origin).days
+
+    return offsets
+
+
+def bin_counts(group_codes, offsets, n_groups, n_days, mask=None):
+    """
+    Returns a (n_groups, n_days) matrix with the number of
+    records of each group on each day.
+    """
+    valid = (group_codes >= 0) & (offsets >= 0) & (offsets < n_days)
+    if mask is not None:
+        valid &= mask
+
+    counts = np.bincount(group_codes[valid] * n_days + offsets[valid],
+                         minlength=n_groups * n_days)
+
+    return counts.reshape(n_groups, n_days)
+
+
+def window_sums(counts, rows, cols, window):
+    """
+    Returns the sum of counts[row, col - window + 1:col + 1]
+    of each (row, col). Days before the first one count as zero.
+    """
+    padded = np.pad(counts, ((0, 0), (window - 1, 0)))
+
+    return padded[rows[:, None], cols[:, None] + np.arange(window)].sum(axis=1)
+
+
+def changed_windows(changed, window):
+    """
+    Returns whether any day of the window ending on each day changed.
+    """
+    csum = np.cumsum(changed, axis=1)
+    shifted = np.zeros_like(csum)
+    shifted[:, window:] = csum[:, :-window]
+
+    return csum - shifted > 0
+
+
+class EpiCurves:
+    """
+    Daily epidemic curves per state and municipality: new confirmed cases
+    by symptom onset date (fecha_sintomas), deaths by date of death
+    (fecha_def) and their trailing rolling averages over window days.
+
+    Series are stored in long format with one row per level, key and day
+    with any non zero value.
+
+    Parameters
+    ----------
+    series: pd.DataFrame
+        Long format series (see from_data).
+    window: int
+        Days of the rolling averages.
+    """
+
+    def __init__(self, series, window=WINDOW):
+        self.series = series
+        self.window = window
+        self.recomputed = None
+
+    @classmethod
+    def from_data(cls, df, window=WINDOW, previous=None):
+        """
+        Builds the curves from cleaned DGE data including
+        entidad_res_original and municipio_res_original.
+
+        Records are binned by integer day offsets. If previous curves
+        (e.g. of the last publication) are present, only the rolling
+        windows including a day whose counts changed are recomputed.
+        The grid starts at the earliest day of both, so records removed
+        before the first day of df are detected as changes.
+
+        Parameters
+        ----------
+        df: pd.DataFrame
+            Cleaned DGE data.
+        window: int
+            Days of the rolling averages.
+        previous: EpiCurves
+            Curves of an earlier publication. Optional.
+        """
+        if previous is not None and previous.window != window:
+            previous = None
+
+        dates = pd.concat([df[date_col] for date_col in SERIES.values()])
+        origin, end = dates.min(), dates.max()
+        # Days of previous before the first record may have changed too
+        if previous is not None and not previous.series.empty and pd.notna(origin):
+            origin = min(origin, previous.series['fecha'].min())
+        n_days = (end - origin).days + 1 if pd.notna(origin) else 0
+        offsets = {name: day_offsets(df[date_col], origin) for name, date_col in SERIES.items()}
+        masks = {
+            'confirmados': status_indicators(df['resultado'])['confirmados'],
+            'muertos': None
+        }
+
+        levels = []
+        recomputed = 0
+        for level, (name_col, key_col) in LEVELS.items():
+            group_codes, keys = pd.factorize(parse_municipality_label(df[key_col]))
+            keys = np.asarray(keys, dtype=np.int64)
+            # Position of the first record of each key, the last write wins
+            positions = np.flatnonzero(group_codes >= 0)[::-1]
+            first = np.empty(len(keys), dtype=np.int64)
+            first[group_codes[positions]] = positions
+            names = np.asarray(df[name_col].iloc[first].to_numpy(), dtype=object)
+
+            values = {}
+            for name in SERIES:
+                counts = bin_counts(group_codes, offsets[name], len(keys), n_days, masks[name])
+                previous_counts, previous_rolling = cls.align(previous, level, name, keys, origin, n_days)
+                changed = changed_windows(counts != previous_counts, window)
+                rows, cols = np.nonzero(changed)
+                rolling = previous_rolling
+                rolling[rows, cols] = window_sums(counts, rows, cols, window) / window
+                recomputed += len(rows)
+
+                values[name] = counts
+                values[cls.rolling_col(name, window)] = rolling
+
+            keep = np.logical_or.reduce([value != 0 for value in values.values()])
+            rows, cols = np.nonzero(keep)
+            level_series = pd.DataFrame({
+                'nivel': level,
+                'cve': keys[rows],
+                'nombre': names[rows],
+                'fecha': origin + pd.to_timedelta(cols, unit='D'),
+                **{col: value[rows, cols] for col, value in values.items()}
+            })
+            levels.append(level_series)
+
+        series = pd.concat(levels, ignore_index=True)
+        series['nivel'] = series['nivel'].astype('category')
+        series['fecha_actualizacion'] = df['fecha_actualizacion'].max()
+
+        curves = cls(series, window)
+        curves.recomputed = recomputed
+        logger.info('Recomputed {} rolling windows'.format(recomputed))
+
+        return curves
+
+    @staticmethod
+    def align(previous, level, name, keys, origin, n_days):
+        """
+        Returns counts and rolling averages of previous on the
+        (keys, days) grid. Counts of days not covered by previous are -1
+        (unknown), so their windows are always recomputed.
+        """
+        counts = np.full((len(keys), n_days), -1, dtype=np.int64)
+        rolling = np.zeros((len(keys), n_days))
+        if previous is None or not n_days:
+            return counts, rolling
+
+        prev = previous.series[previous.series['nivel'] == level]
+        if prev.empty:
+            return counts, rolling
+
+        # Rows not stored inside the days covered by previous are zeros
+        first = max((prev['fecha'].min() - origin).days, 0)
+        last = min((prev['fecha'].max() - origin).days, n_days - 1)
+        counts[:, first:last + 1] = 0
+
+        rows = pd.Index(keys).get_indexer(prev['cve'])
+        cols = day_offsets(prev['fecha'], origin)
+        valid = (rows >= 0) & (cols >= 0) & (cols < n_days)
+        counts[rows[valid], cols[valid]] = prev[name].to_numpy()[valid]
+        rolling[rows[valid], cols[valid]] = prev[EpiCurves.rolling_col(name, previous.window)].to_numpy()[valid]
+
+        return counts, rolling
+
+    @staticmethod
+    def rolling_col(name, window):
+        return '{}_{}d'.format(name, window)
+
+    @classmethod
+    def read(cls, path, cache_format='parquet'):
+        series = read_table(path, cache_format)
+        # csv caches do not keep dtypes
+        for col in ['fecha', 'fecha_actualizacion']:
+            series[col] = pd.to_datetime(series[col])
+        series['nivel'] = series['nivel'].astype('category')
+        # Rolling columns are named <series>_<window>d
+        rolling_col = [col for col in series if col.startswith('confirmados_')][0]
+        window = int(rolling_col[len('confirmados_'):-1])
+
+        return cls(series, window)
+
+    def write(self, path, cache_format='parquet'):
+        write_table(self.series, path, cache_format)
+
+    @property
+    def update_date(self):
+        return self.series['fecha_actualizacion'].max()
+
+    def query(self, level='estado', state=None, start_date=None, end_date=None):
+        """
+        Returns the daily series of level.
+
+        Parameters
+        ----------
+        level: str
+            One of estado, municipio.
+        state: str
+            Only return this state, or its municipalities.
+        start_date, end_date: str or pd.Timestamp
+            Inclusive date range.
+
+        Returns
+        -------
+        DataFrame with cve, nombre, fecha, the daily counts and their
+        rolling averages, including days without records.
+        """
+        assert level in LEVELS, 'level must be one of {}'.format(', '.join(LEVELS))
+
+        series = self.series[self.series['nivel'] == level]
+        if state is not None:
+            states = self.series[(self.series['nivel'] == 'estado') & \
+                                 (self.series['nombre'].str.lower() == state.lower())]
+            cve_ent = states['cve'].unique()
+            cve = series['cve'] if level == 'estado' else series['cve'] // MUNICIPALITY_FACTOR
+            series = series[cve.isin(cve_ent)]
+
+        start = pd.to_datetime(start_date) if start_date is not None else self.series['fecha'].min()
+        end = pd.to_datetime(end_date) if end_date is not None else self.series['fecha'].max()
+        series = series[(series['fecha'] >= start) & (series['fecha'] <= end)]
+
+        # Days without records are not stored
+        names = series.drop_duplicates('cve').set_index('cve')['nombre']
+        grid = pd.MultiIndex.from_product([names.index, pd.date_range(start, end)],
+                                          names=['cve', 'fecha'])
+        value_cols = [col for col in self.series if col.startswith(tuple(SERIES))]
+        series = series.set_index(['cve', 'fecha'])[value_cols] \
+                       .reindex(grid, fill_value=0) \
+                       .reset_index()
+        series.insert(1, 'nombre', names.reindex(series['cve']).to_numpy())
+
+        return series
@@ -0,0 +1,173 @@
+import contextlib
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+
+class Stage:
+    """
+    Measures of one run of a pipeline stage.
+
+    Attributes
+    ----------
+    name: str
+        Stage name, e.g. download, decompress, parse, decode, cache_write.
+    seconds: float
+        Wall time.
+    bytes: int
+        Bytes transferred, read or written, if known.
+    rows: int
+        Rows processed, if known.
+    peak_memory: int
+        Peak traced memory in bytes while the stage ran,
+        only if memory is tracked.
+    info: dict
+        Other details, e.g. the decoded column.
+    """
+
+    def __init__(self, name, **info):
+        self.name = name
+        self.seconds = None
+        self.bytes = None
+        self.rows = None
+        self.peak_memory = None
+        self.info = info
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'seconds': self.seconds,
+            'bytes': self.bytes,
+            'rows': self.rows,
+            'peak_memory': self.peak_memory,
+            **self.info
+        }
+
+    def __repr__(self):
+        return 'Stage({})'.format(', '.join('{}={!r}'.format(key, value) \
+                                            for key, value in self.as_dict().items()))
+
+
+class PipelineStats:
+    """
+    Collects a Stage for every step run by DGE, download_file and DGEPlot.
+
+    Parameters
+    ----------
+    hooks: list
+        Callables called with each finished Stage,
+        e.g. to export it to a metrics system.
+    track_memory: bool
+        Whether to record peak memory of each stage with tracemalloc.
+        Slows down the pipeline. Default False. Before Python 3.9 the
+        peak cannot be reset, so each stage reports the peak since
+        tracing started.
+    """
+
+    def __init__(self, hooks=None, track_memory=False):
+        self.hooks = list(hooks or [])
+        self.track_memory = track_memory
+        self.stages = []
+        self._active = []
+        self._tracing = False
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        """
+        Context manager measuring a stage. Yields the Stage so
+        bytes and rows can be filled inside the block.
+        """
+        record = Stage(name, **info)
+        if self.track_memory:
+            self._start_memory(record)
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            if self.track_memory:
+                self._stop_memory(record)
+            self.add(record)
+
+    def add(self, record):
+        """Stores a finished Stage and calls the hooks with it."""
+        with self._lock:
+            self.stages.append(record)
+        for hook in self.hooks:
+            hook(record)
+
+    def _flush_peak(self):
+        # The peak since the last reset belongs to every active stage
+        peak = tracemalloc.get_traced_memory()[1]
+        for record in self._active:
+            record.peak_memory = max(record.peak_memory or 0, peak)
+        # Only available on Python 3.9+
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def _start_memory(self, record):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+            self._flush_peak()
+            self._active.append(record)
+
+    def _stop_memory(self, record):
+        with self._lock:
+            self._flush_peak()
+            self._active.remove(record)
+            if not self._active and self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+
+    def to_frame(self):
+        """Returns a DataFrame with one row per stage run."""
+        with self._lock:
+            return pd.DataFrame([record.as_dict() for record in self.stages])
+
+    def summary(self):
+        """
+        Returns total seconds, bytes and rows, maximum peak memory
+        and number of runs of each stage.
+        """
+        df = self.to_frame()
+        if df.empty:
+            return df
+
+        return df.groupby('stage', sort=False).agg(
+            seconds=('seconds', 'sum'),
+            bytes=('bytes', 'sum'),
+            rows=('rows', 'sum'),
+            peak_memory=('peak_memory', 'max'),
+            runs=('seconds', 'size')
+        )
+
+
+def stage(stats, name, **info):
+    """
+    Returns stats.stage(name, **info), or a context yielding an
+    unrecorded Stage if stats is None.
+    """
+    if stats is None:
+        return contextlib.nullcontext(Stage(name, **info))
+
+    return stats.stage(name, **info)
+
+
+def record_stage(stats, name, seconds, bytes=None, rows=None, **info):
+    """
+    Records a stage measured by the caller, if stats is present.
+    """
+    if stats is None:
+        return
+
+    record = Stage(name, **info)
+    record.seconds = seconds
+    record.bytes = bytes
+    record.rows = rows
+    stats.add(record)
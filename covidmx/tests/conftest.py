@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+# Synthetic publications and the stand-in server of the benchmarks
+BENCHMARKS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'benchmarks'))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+FIXTURE_ROWS = 2000
+HISTORICAL_DATES = ['2020-04-12', '2020-04-13']
+
+
+@pytest.fixture(scope='session')
+def fixtures_dir(tmp_path_factory):
+    from synthetic import write_fixtures
+
+    return write_fixtures(str(tmp_path_factory.mktemp('fixtures')), FIXTURE_ROWS,
+                          historical_dates=HISTORICAL_DATES)
+
+
+@pytest.fixture
+def stand_in_server(fixtures_dir):
+    """
+    Serves the synthetic DGE files and points covidmx urls to them.
+    """
+    from server import stand_in
+
+    with stand_in(fixtures_dir) as base:
+        yield base
+
+
+@pytest.fixture(scope='session')
+def geo_cache(tmp_path_factory):
+    """
+    Geometry cache shared by the tests that draw maps.
+    """
+    from covidmx.geometry import GeoCache
+
+    return GeoCache(str(tmp_path_factory.mktemp('geo')))
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    """
+    Serves an empty directory with the stand-in server. Yields the
+    directory, its base url and the headers of every request.
+    """
+    from server import serve
+
+    directory = tmp_path / 'served'
+    directory.mkdir()
+    with serve(directory) as (base, requests_log):
+        yield directory, base, requests_log
@@ -0,0 +1,31 @@
+import pytest
+import pandas as pd
+from covidmx.changelog import ChangeLog
+
+
+def make_publication(ids, results, date):
+    return pd.DataFrame({
+        'fecha_actualizacion': pd.to_datetime(date),
+        'id_registro': ids,
+        'resultado': pd.Categorical(results, categories=['Positivo', 'Negativo']),
+        'edad': range(len(ids))
+    })
+
+
+def test_changelog_reconstructs_publications(tmp_path):
+    first = make_publication(['a', 'b', 'c'], ['Positivo', 'Negativo', 'Negativo'], '2020-06-01')
+    second = make_publication(['a', 'b', 'd'], ['Positivo', 'Positivo', 'Negativo'], '2020-06-02')
+    second['edad'] = [0, 1, 3]
+
+    changelog = ChangeLog(str(tmp_path))
+    changelog.append(first, '2020-06-01')
+    counts = changelog.append(second, '2020-06-02')
+
+    assert counts == {'insert': 1, 'update': 1, 'delete': 1}
+    for date, expected in [('2020-06-01', first), ('2020-06-02', second)]:
+        rebuilt = changelog.reconstruct(date)[expected.columns]
+        rebuilt = rebuilt.sort_values('id_registro').reset_index(drop=True)
+        pd.testing.assert_frame_equal(rebuilt, expected)
+
+    with pytest.raises(ValueError):
+        changelog.append(second, '2020-06-02')
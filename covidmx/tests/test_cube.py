@@ -0,0 +1,32 @@
+import pandas as pd
+from covidmx.cube import DGECube
+
+
+def test_query_matches_groupby(tmp_path):
+    df = pd.DataFrame({
+        'entidad_res': ['A', 'A', 'B', 'B'],
+        'entidad_res_original': [1, 1, 2, 2],
+        'municipio_res': ['A1', 'A2', 'B1', 'B1'],
+        'municipio_res_original': [1001, 1002, 2001, 2001],
+        'resultado': ['Positivo SARS-CoV-2', 'Resultado pendiente',
+                      'Positivo SARS-CoV-2', 'No positivo SARS-CoV-2'],
+        'fecha_def': pd.to_datetime([None, '2020-04-03', None, None]),
+        'fecha_sintomas': pd.to_datetime(['2020-04-01', '2020-04-01', '2020-04-02', '2020-04-03']),
+        'fecha_ingreso': pd.to_datetime(['2020-04-02', '2020-04-02', '2020-04-02', '2020-04-04']),
+        'fecha_actualizacion': pd.to_datetime(['2020-04-05'] * 4)
+    })
+
+    cube = DGECube.from_data(df)
+    cube.write(tmp_path / 'cube.csv', 'csv')
+    cube = DGECube.read(tmp_path / 'cube.csv', 'csv')
+
+    states = cube.query(['confirmados', 'muertos'])
+    assert states['confirmados'].tolist() == [1, 1]
+    assert states['muertos'].tolist() == [1, 0]
+
+    muns = cube.query('sospechosos', by=['municipio_res', 'cve_mun'], state='a')
+    assert muns['sospechosos'].tolist() == [0, 1]
+
+    series = cube.query('confirmados', by=['fecha'], end_date='2020-04-02')
+    assert series['confirmados'].tolist() == [1, 1]
+    assert cube.update_date == pd.Timestamp('2020-04-05')
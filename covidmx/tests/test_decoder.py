@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from covidmx.decoder import CodeTable, DateTable
+from covidmx.decoder import municipality_key, parse_municipality_label
+
+
+def test_decodes_like_replace():
+    mapping = {1: 'SI', 2: 'NO', 97: 'NO APLICA', 98: 'SE IGNORA', 99: 'NO ESPECIFICADO'}
+    codes = pd.Series(np.random.choice([1, 2, 97, 98, 99, 5], 1000))
+
+    decoded = CodeTable(mapping).decode(codes)
+    expected = codes.replace(mapping).astype(str)
+
+    assert isinstance(decoded.dtype, pd.CategoricalDtype)
+    assert (decoded.astype(str) == expected).all()
+
+
+def test_decodes_string_keys():
+    codes = pd.Series(['9_1', '9_2', None, '3_4'])
+
+    decoded = CodeTable({'9_1': 'A', '9_2': 'B'}).decode(codes)
+
+    assert decoded.tolist()[:2] == ['A', 'B']
+    assert pd.isnull(decoded[2])
+    assert decoded[3] == '3_4'
+
+
+def test_municipality_keys():
+    key = municipality_key(pd.Series([9, 14, 9]), pd.Series([1, 120, 1]))
+
+    assert key.dtype == np.int64
+    assert key.tolist() == [9001, 14120, 9001]
+    assert parse_municipality_label(pd.Series(['9_1', '14_120', '9_1'])).tolist() == key.tolist()
+
+
+def test_date_table_like_to_datetime():
+    dates = DateTable('%Y-%m-%d')
+    ingreso = pd.Series(['2020-04-01', '2020-04-02', '9999-99-99', None, '2020-04-01'])
+    defuncion = pd.Series(['9999-99-99', '2020-04-03'], index=[3, 7])
+
+    for values in [ingreso, defuncion]:
+        expected = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+        pd.testing.assert_series_equal(dates.decode(values), expected)
+
+    # Distinct values are parsed once across columns
+    assert len(dates.parsed) == 4
@@ -1,6 +1,16 @@
 import pytest
 from covidmx import CovidMX
 import shutil 
+import os
+import json
+import multiprocessing
+import threading
+import numpy as np
+import pandas as pd
+import covidmx.dge as dge_module
+from covidmx.decoder import compile_catalogue
+from covidmx.stats import PipelineStats
+from covidmx.utils import concat_frames, read_table
 
 def test_returns_data():
     try:
@@ -20,6 +30,194 @@ def test_returns_data():
         assert False, "Test DGE failed"
 
 
+@pytest.mark.parametrize('start_method', ['fork', 'spawn'])
+def test_parallel_clean_matches_serial(monkeypatch, start_method):
+    if start_method not in multiprocessing.get_all_start_methods():
+        pytest.skip('{} not available'.format(start_method))
+    context = multiprocessing.get_context(start_method)
+    monkeypatch.setattr(dge_module.multiprocessing, 'get_context', lambda: context)
+    monkeypatch.setattr(dge_module, 'MIN_PARTITION_ROWS', 100)
+    catalogo_dict = compile_catalogue({
+        'SEXO': {1: 'MUJER', 2: 'HOMBRE', 99: 'NO ESPECIFICADO'},
+        'ENTIDADES': {1: 'AGUASCALIENTES', 14: 'JALISCO'}
+    })
+    desc_dict = {'SEXO': 'SEXO', 'ENTIDAD_RES': 'ENTIDADES',
+                 'FECHA_SINTOMAS': '%Y-%m-%d', 'ID_REGISTRO': None}
+
+    rng = np.random.default_rng(0)
+    raw = pd.DataFrame({
+        'ID_REGISTRO': np.arange(1000).astype(str),
+        'SEXO': rng.choice([1, 2, 99], 1000),
+        'ENTIDAD_RES': rng.choice([1, 14], 1000),
+        'FECHA_SINTOMAS': rng.choice(['2020-04-01', '2020-04-02', '9999-99-99'], 1000)
+    })
+    # Unknown codes only present in some partitions
+    raw.loc[5, 'SEXO'] = 7
+    raw.loc[990, 'SEXO'] = 3
+
+    serial_raw, parallel_raw = raw.copy(), raw.copy()
+    serial = dge_module.DGE(data_path=None).decode_data(serial_raw, catalogo_dict, desc_dict, ['SEXO'])
+    parallel = dge_module.DGE(data_path=None, n_jobs=3).decode_parallel(parallel_raw, catalogo_dict,
+                                                                       desc_dict, ['SEXO'])
+
+    pd.testing.assert_frame_equal(serial, parallel)
+    # Both paths decode their input in place
+    pd.testing.assert_frame_equal(serial_raw, parallel_raw)
+    assert list(parallel['sexo'].cat.categories) == ['MUJER', 'HOMBRE', 'NO ESPECIFICADO', '3', '7']
+
+
+@pytest.mark.parametrize('cache_format', ['parquet', 'feather'])
+def test_cache_returns_clean_dtypes(stand_in_server, tmp_path, cache_format):
+    fresh = dge_module.DGE(data_path=str(tmp_path), cache_format=cache_format).get_data()
+    cached = dge_module.DGE(data_path=str(tmp_path), cache_format=cache_format).get_data()
+
+    assert isinstance(cached['sexo'].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_datetime64_any_dtype(cached['fecha_sintomas'])
+    pd.testing.assert_frame_equal(fresh, cached)
+
+
+def test_aggregates_build_clean_cache(stand_in_server, tmp_path):
+    dge = dge_module.DGE(data_path=str(tmp_path), clean=False)
+    cube = dge.get_cube()
+    clean_data_file = dge.get_clean_data_file()
+
+    assert dge.clean is False
+    assert os.path.exists(clean_data_file)
+    mtime = os.path.getmtime(clean_data_file)
+
+    curves = dge.get_series()
+    assert os.path.getmtime(clean_data_file) == mtime
+    assert len(cube.cube) and len(curves.series)
+
+
+@pytest.mark.parametrize('chunksize', [None, 300])
+def test_streaming_matches_full_read(stand_in_server, tmp_path, chunksize):
+    full = dge_module.DGE(data_path=str(tmp_path / 'full')).get_data()
+    streamed = dge_module.DGE(data_path=str(tmp_path / 'streamed'), chunksize=chunksize).get_data()
+
+    pd.testing.assert_frame_equal(full, streamed)
+    if chunksize is not None:
+        chunks = list(dge_module.DGE(data_path=str(tmp_path / 'streamed'), chunksize=chunksize).iter_data())
+        assert [len(chunk) for chunk in chunks] == [300] * 6 + [200]
+        pd.testing.assert_frame_equal(concat_frames(chunks), full)
+
+
+def test_reads_archive_without_extracting(stand_in_server, tmp_path):
+    from synthetic import DATA_FILE
+
+    extracted = dge_module.DGE(data_path=str(tmp_path / 'extracted'), extract=True).get_data()
+
+    # Interrupted download of the archive
+    dge = dge_module.DGE(data_path=str(tmp_path / 'archive'), stats=PipelineStats())
+    archive = tmp_path / 'archive' / DATA_FILE
+    dge.get_data_file()
+    content = archive.read_bytes()
+    metadata = json.loads((tmp_path / 'archive' / (DATA_FILE + '.json')).read_text())
+    (tmp_path / 'archive' / (DATA_FILE + '.part')).write_bytes(content[:1000])
+    (tmp_path / 'archive' / (DATA_FILE + '.json')).write_text(json.dumps(dict(metadata, complete=False)))
+    archive.unlink()
+
+    read = dge.get_data()
+    mtime = archive.stat().st_mtime_ns
+    dge.get_data_file()
+
+    downloads = dge.stats.to_frame().query('stage == "download" and file == @DATA_FILE')
+    assert downloads['bytes'].tolist() == [len(content), len(content) - 1000, 0]
+    assert archive.read_bytes() == content and archive.stat().st_mtime_ns == mtime
+    assert not list((tmp_path / 'archive').glob('*.csv'))
+    pd.testing.assert_frame_equal(extracted, read)
+
+
+def test_dictionary_fetched_with_data(stand_in_server, tmp_path, monkeypatch):
+    read_dictionary, get_data_file = dge_module.DGE.read_dictionary, dge_module.DGE.get_data_file
+    dictionary_read = threading.Event()
+    overlapped = []
+
+    def signal_dictionary(self):
+        result = read_dictionary(self)
+        dictionary_read.set()
+        return result
+
+    def fetch_after_dictionary(self):
+        # Only finishes after the dictionary if both are fetched concurrently
+        overlapped.append(dictionary_read.wait(timeout=10))
+        return get_data_file(self)
+
+    monkeypatch.setattr(dge_module.DGE, 'read_dictionary', signal_dictionary)
+    monkeypatch.setattr(dge_module.DGE, 'get_data_file', fetch_after_dictionary)
+    df, catalogo = dge_module.DGE(data_path=str(tmp_path), return_catalogo=True).get_data()
+
+    assert overlapped == [True]
+    assert len(df) and 'Catálogo SEXO' in catalogo
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_historical_batch_matches_single_dates(stand_in_server, tmp_path, n_jobs):
+    batch = dge_module.DGE(data_path=str(tmp_path / 'batch'))
+    files = batch.get_historical_data('12-04-2020', '13-04-2020', n_jobs=n_jobs)
+
+    assert list(files) == list(pd.to_datetime(['2020-04-12', '2020-04-13']))
+    for date, clean_data_file in files.items():
+        single = dge_module.DGE(data_path=str(tmp_path / 'single'), date=date.strftime('%d-%m-%Y'))
+        assert os.path.exists(clean_data_file)
+        pd.testing.assert_frame_equal(read_table(clean_data_file, 'parquet'), single.get_data())
+
+
+def test_dictionary_cache_follows_hash(stand_in_server, tmp_path):
+    from synthetic import DICTIONARY_FILE
+
+    dge = dge_module.DGE(data_path=str(tmp_path), stats=PipelineStats())
+    metadata_file = tmp_path / (DICTIONARY_FILE + '.json')
+
+    first = dge.read_dictionary()
+    dge.read_dictionary()
+    # A new dictionary is published
+    metadata = json.loads(metadata_file.read_text())
+    metadata_file.write_text(json.dumps(dict(metadata, sha256='0' * 64)))
+    updated = dge.read_dictionary()
+
+    cached = dge.stats.to_frame().query('stage == "dictionary"')['cached'].tolist()
+    assert cached == [False, True, False]
+    assert pd.read_pickle(dge.get_dictionary_cache_file())['sha256'] == '0' * 64
+    pd.testing.assert_frame_equal(first[1], updated[1])
+
+
+@pytest.mark.parametrize('parser', ['pandas', 'pyarrow'])
+def test_streaming_text_columns(stand_in_server, tmp_path, parser):
+    from synthetic import make_chunk
+
+    # Text columns look numeric in the first chunk only
+    df = make_chunk(600)
+    df['ID_REGISTRO'] = ['{:07d}'.format(i) if i < 300 else 'a{:06d}'.format(i) for i in range(len(df))]
+    df['PAIS_ORIGEN'] = np.where(df.index < 500, '97', 'Estados Unidos')
+    data_file = str(tmp_path / 'data.csv')
+    df.to_csv(data_file, index=False)
+
+    dge = dge_module.DGE(data_path=str(tmp_path), chunksize=300, parser=parser)
+    catalogo, descripcion = dge.read_dictionary()
+    dge.write_cache(dge.iter_clean_chunks(data_file, catalogo, descripcion), str(tmp_path / 'clean.parquet'))
+    streamed = read_table(tmp_path / 'clean.parquet', 'parquet')
+
+    catalogo_dict, desc_dict = dge.compile_dictionary(catalogo, descripcion)
+    full = dge.get_encoded_data(data_file, column_types=dge.get_column_types(catalogo_dict, desc_dict))
+    full = dge.decode_data(full, catalogo_dict, desc_dict)
+
+    assert streamed['id_registro'].tolist() == df['ID_REGISTRO'].tolist()
+    assert streamed['pais_origen'].tolist() == df['PAIS_ORIGEN'].tolist()
+    pd.testing.assert_frame_equal(streamed, full)
+
+
+@pytest.mark.parametrize('chunksize', [None, 300])
+def test_arrow_parser_matches_pandas(stand_in_server, tmp_path, chunksize):
+    pytest.importorskip('pyarrow')
+    frames = [
+        dge_module.DGE(data_path=str(tmp_path / parser), chunksize=chunksize, parser=parser).get_data()
+        for parser in ['pandas', 'pyarrow']
+    ]
+
+    pd.testing.assert_frame_equal(*frames)
+
+
 def main():
     test_returns_data()
 
@@ -0,0 +1,17 @@
+from covidmx.geometry import GeoCache, _geometries
+
+
+def test_geo_cache(tmp_path):
+    mun_geo = GeoCache(tmp_path).get('municipality')
+    _geometries.clear()
+
+    cached = GeoCache(tmp_path)
+    cdmx = cached.get_state('municipality', 9)
+    simplified = cached.get('municipality', tolerance=1000)
+
+    assert (tmp_path / 'mun.parquet').exists()
+    assert cached.get('municipality').crs == mun_geo.crs
+    assert (cached.get('municipality')['cve_mun'] == mun_geo['cve_mun']).all()
+    assert (cdmx['cve_mun'] // 1000 == 9).all()
+    assert len(cdmx) == (mun_geo['cve_ent'] == 9).sum()
+    assert len(simplified) == len(mun_geo)
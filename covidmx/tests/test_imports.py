@@ -0,0 +1,18 @@
+import subprocess
+import sys
+import pytest
+
+PLOTTING = ['matplotlib', 'mapsmx', 'geopandas']
+
+
+@pytest.mark.parametrize('module, unexpected', [
+    ('covidmx', ['pandas', 'requests'] + PLOTTING),
+    ('covidmx.dge', ['wget', 'unidecode', 'tqdm'] + PLOTTING),
+    ('covidmx.serendipia', ['tqdm'] + PLOTTING),
+])
+def test_lazy_imports(module, unexpected):
+    script = 'import sys, {}; print(" ".join(sys.modules))'.format(module)
+    loaded = subprocess.run([sys.executable, '-c', script], check=True,
+                            capture_output=True, text=True).stdout.split()
+
+    assert [name for name in unexpected if name in loaded] == []
@@ -0,0 +1,48 @@
+import pytest
+import os
+from concurrent.futures import ProcessPoolExecutor
+from covidmx.locking import FileLock, atomic_path
+
+
+def build_once(path, log):
+    with FileLock(path):
+        if os.path.exists(path):
+            return False
+        with open(log, 'a') as f:
+            f.write('build\n')
+        with atomic_path(path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                f.write('published')
+        return True
+
+
+def test_single_flight(tmp_path):
+    path, log = tmp_path / 'data.csv', tmp_path / 'builds.log'
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        built = list(executor.map(build_once, [path] * 8, [log] * 8))
+
+    assert sum(built) == 1
+    assert log.read_text() == 'build\n'
+    assert path.read_text() == 'published'
+
+
+def test_lock_timeout(tmp_path):
+    with FileLock(tmp_path / 'data.csv'):
+        with pytest.raises(TimeoutError):
+            FileLock(tmp_path / 'data.csv', timeout=0.2).acquire()
+
+    with FileLock(tmp_path / 'data.csv', timeout=0.2) as lock:
+        assert not lock.waited
+
+
+def test_atomic_path_keeps_previous(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text('previous')
+
+    with pytest.raises(ValueError):
+        with atomic_path(path) as tmp_file:
+            tmp_file.write_text('partial')
+            raise ValueError
+
+    assert path.read_text() == 'previous'
+    assert os.listdir(tmp_path) == ['data.csv']
@@ -1,5 +1,11 @@
 import pytest
+import os
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from covidmx import CovidMX
+from covidmx.cube import DGECube
 
 
 def test_makes_plot():
@@ -12,6 +18,14 @@ def test_makes_plot():
             cdmx_map = dge_plot.plot_map(status=st, state='CIUDAD DE MÉXICO', save_file_name=file_name)
             cdmx_map_with_muns = dge_plot.plot_map(status=st, state='CIUDAD DE MÉXICO', add_municipalities=True, save_file_name=file_name)
 
+        specs = [{'status': st, 'state': state, 'add_municipalities': muns,
+                  'save_file_name': '{}-{}-{}.png'.format(st, state, muns)} \
+                 for st in dge_plot.available_status \
+                 for state in [None, 'CIUDAD DE MÉXICO'] \
+                 for muns in [False, True]]
+        files = dge_plot.plot_maps(specs, n_jobs=2)
+        assert len(files) == len(specs)
+
         dge_plot_historical = CovidMX(date='04-12-2020', date_format='%m-%d-%Y').get_plot()
         for st in dge_plot_historical.available_status:
             mx_map_h = dge_plot_historical.plot_map(status=st, save_file_name=file_name)
@@ -20,3 +34,89 @@ def test_makes_plot():
             cdmx_map_with_muns_h = dge_plot_historical.plot_map(status=st, state='CIUDAD DE MÉXICO', add_municipalities=True, save_file_name=file_name)
     except BaseException:
         assert False, "Test DGEPlot failed"
+
+
+@pytest.fixture
+def dge_plot(geo_cache):
+    from covidmx.dge_plot import DGEPlot
+
+    rng = np.random.default_rng(0)
+    municipalities = geo_cache.get('municipality').sample(5000, replace=True, random_state=0)
+    cve_ent = municipalities['cve_ent'].to_numpy()
+    df = pd.DataFrame({
+        'entidad_res': np.where(cve_ent == 9, 'CIUDAD DE MÉXICO', 'ESTADO ' + cve_ent.astype(str)),
+        'entidad_res_original': cve_ent,
+        'municipio_res': 'MUNICIPIO ' + municipalities['cve_mun'].astype(str).to_numpy(),
+        'municipio_res_original': municipalities['cve_mun'].to_numpy(),
+        'resultado': rng.choice(['Positivo SARS-CoV-2', 'No positivo SARS-CoV-2',
+                                 'Resultado pendiente'], len(municipalities)),
+        'fecha_def': pd.to_datetime(np.where(rng.random(len(municipalities)) < 0.3, '2020-04-03', None)),
+        'fecha_sintomas': pd.Timestamp('2020-04-01'),
+        'fecha_ingreso': pd.Timestamp('2020-04-02'),
+        'fecha_actualizacion': pd.Timestamp('2020-04-05')
+    })
+
+    return DGEPlot(None, None, None, cube=DGECube.from_data(df), geo_cache=geo_cache)
+
+
+def test_plot_maps_offline(dge_plot, tmp_path, monkeypatch):
+    saved = {}
+    savefig = Figure.savefig
+
+    def record_layers(figure, file_name, **kwargs):
+        ax, = figure.axes
+        legend = ax.get_legend()
+        labels = [] if legend is None else [text.get_text() for text in legend.get_texts()]
+        saved[str(file_name)] = (ax.get_title(), len(ax.collections), len(ax.patches), labels)
+        return savefig(figure, file_name, **kwargs)
+
+    monkeypatch.setattr(Figure, 'savefig', record_layers)
+    specs = [{'status': st, 'state': state, 'add_municipalities': muns, 'legend': st != 'muertos',
+              'save_file_name': str(tmp_path / 'group-{}-{}-{}.png'.format(st, state, muns))} \
+             for state, muns in [(None, False), ('CIUDAD DE MÉXICO', True)] \
+             for st in dge_plot.available_status]
+    files = dge_plot.plot_maps(specs, n_jobs=1)
+    grouped = [saved[file] for file in files]
+
+    # Each map drawn on its own figure
+    saved.clear()
+    for spec in specs:
+        dge_plot.plot_maps([dict(spec, save_file_name=spec['save_file_name'].replace('group', 'single'))],
+                           n_jobs=1)
+    single = [saved[spec['save_file_name'].replace('group', 'single')] for spec in specs]
+
+    assert files == [spec['save_file_name'] for spec in specs]
+    assert all(os.path.getsize(file) for file in files)
+    # Layers and legends of other statuses are not left on the figure
+    assert grouped == single
+    # plot_map draws with the same defaults
+    dge_plot.plot_map(save_file_name=str(tmp_path / 'plot_map.png'))
+    assert saved[str(tmp_path / 'plot_map.png')] == grouped[0]
+
+    pooled = dge_plot.plot_maps([dict(spec, save_file_name=spec['save_file_name'].replace('group', 'pool')) \
+                                 for spec in specs], n_jobs=2)
+    for file, pooled_file in zip(files, pooled):
+        np.testing.assert_array_equal(plt.imread(file), plt.imread(pooled_file))
+
+
+def test_dge_data_is_read_only(dge_plot, geo_cache):
+    from covidmx.dge_plot import DGEPlot
+
+    assert dge_plot.dge_data is None
+    df = pd.DataFrame({
+        'entidad_res': ['A', 'B'],
+        'entidad_res_original': [1, 2],
+        'municipio_res': ['A1', 'B1'],
+        'municipio_res_original': [1001, 2001],
+        'resultado': ['Positivo SARS-CoV-2', 'Resultado pendiente'],
+        'fecha_def': pd.to_datetime([None, '2020-04-03']),
+        'fecha_sintomas': pd.to_datetime(['2020-04-01', '2020-04-02']),
+        'fecha_ingreso': pd.to_datetime(['2020-04-02', '2020-04-02']),
+        'fecha_actualizacion': pd.to_datetime(['2020-04-05'] * 2)
+    })
+    from_data = DGEPlot(df, None, None, geo_cache=geo_cache)
+
+    assert from_data.dge_data['confirmados'].tolist() == [True, False]
+    assert from_data.dge_data['cve_mun'].tolist() == [1001, 2001]
+    with pytest.raises(AttributeError):
+        from_data.dge_data = df
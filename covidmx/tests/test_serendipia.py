@@ -1,5 +1,8 @@
+import os
 import pytest
+import pandas as pd
 from covidmx import CovidMX
+from covidmx.utils import write_metadata
 
 
 def test_returns_data():
@@ -11,3 +14,20 @@ def test_returns_data():
         suspects = CovidMX(source='Serendipia', kind="suspects").get_data()
     except BaseException:
         assert False, "Test Serendipia failed"
+
+
+def test_cached_range(tmp_path):
+    serendipia = CovidMX(source='Serendipia', kind='confirmed',
+                         start_date='2020-05-30', end_date='2020-05-31',
+                         date_format='%Y-%m-%d', data_path=str(tmp_path))
+    assert serendipia.dates == ['2020-05-30', '2020-05-31']
+
+    # Completely downloaded files are read without network requests
+    os.makedirs(serendipia.data_path)
+    for date in serendipia.dates:
+        cache_file = serendipia.get_cache_file(date, 'confirmed')
+        pd.DataFrame({'N° Caso': ['1'], 'Estado': ['JALISCO']}).to_csv(cache_file, index=False)
+        write_metadata(cache_file + '.json', {'complete': True})
+
+    df = serendipia.get_data()
+    assert df['fecha_busqueda'].dt.strftime('%Y-%m-%d').tolist() == serendipia.dates
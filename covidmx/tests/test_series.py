@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from covidmx.dge import DGE
+from covidmx.series import EpiCurves
+
+
+def make_data(n_rows=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    cve_ent = rng.choice([9, 14], n_rows)
+    dates = pd.Timestamp('2020-04-01') + pd.to_timedelta(rng.randint(0, 40, n_rows), unit='D')
+    fecha_def = pd.Series(dates + pd.Timedelta(days=10)).where(rng.rand(n_rows) < 0.1)
+
+    return pd.DataFrame({
+        'entidad_res': np.where(cve_ent == 9, 'CIUDAD DE MÉXICO', 'JALISCO'),
+        'entidad_res_original': cve_ent,
+        'municipio_res': 'MUN',
+        'municipio_res_original': cve_ent * 1000 + rng.randint(1, 4, n_rows),
+        'resultado': rng.choice(['Positivo SARS-CoV-2', 'No positivo SARS-CoV-2'], n_rows),
+        'fecha_sintomas': dates,
+        'fecha_def': fecha_def,
+        'fecha_actualizacion': pd.Timestamp('2020-06-01')
+    })
+
+
+def test_series_match_groupby(tmp_path):
+    df = make_data()
+    curves = EpiCurves.from_data(df)
+    curves.write(tmp_path / 'series.csv', 'csv')
+    curves = EpiCurves.read(tmp_path / 'series.csv', 'csv')
+
+    series = curves.query('estado', state='jalisco')
+    confirmed = df[(df['entidad_res'] == 'JALISCO') & (df['resultado'] == 'Positivo SARS-CoV-2')]
+    expected = confirmed.groupby('fecha_sintomas').size() \
+                        .reindex(series['fecha'], fill_value=0)
+    assert series['confirmados'].tolist() == expected.tolist()
+    assert np.allclose(series['confirmados_7d'], expected.rolling(7, min_periods=1).sum() / 7)
+    assert series['muertos'].sum() == df.loc[df['entidad_res'] == 'JALISCO', 'fecha_def'].notna().sum()
+
+    municipalities = curves.query('municipio', state='JALISCO')
+    assert (municipalities['cve'] // 1000 == 14).all()
+    assert municipalities.groupby('fecha')['confirmados'].sum().tolist() == series['confirmados'].tolist()
+
+
+def test_incremental_update():
+    previous = EpiCurves.from_data(make_data())
+    df = make_data(seed=1)
+
+    updated = EpiCurves.from_data(df, previous=previous)
+    full = EpiCurves.from_data(df)
+
+    pd.testing.assert_frame_equal(updated.series, full.series)
+    assert EpiCurves.from_data(df, previous=full).recomputed == 0
+
+
+def test_first_publication_series(stand_in_server, tmp_path):
+    first = DGE(data_path=str(tmp_path), date='12-04-2020').get_series()
+    second = DGE(data_path=str(tmp_path), date='13-04-2020').get_series()
+
+    assert len(first.series) and first.update_date == pd.Timestamp('2020-04-12')
+    assert second.update_date == pd.Timestamp('2020-04-13')
+    assert (tmp_path / 'datos_abiertos_covid19_12.04.2020_series.parquet').exists()
+
+
+def test_incremental_update_later_origin():
+    df = make_data()
+    previous = EpiCurves.from_data(df)
+    # Earliest records corrected in the new publication
+    df = df[df['fecha_sintomas'] >= pd.Timestamp('2020-04-06')]
+
+    updated = EpiCurves.from_data(df, previous=previous)
+    full = EpiCurves.from_data(df)
+
+    pd.testing.assert_frame_equal(updated.series, full.series)
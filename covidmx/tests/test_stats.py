@@ -0,0 +1,35 @@
+from covidmx.stats import PipelineStats, record_stage, stage
+
+
+def test_pipeline_stats():
+    finished = []
+    stats = PipelineStats(hooks=[finished.append], track_memory=True)
+
+    with stats.stage('parse', file='a.csv') as record:
+        with stats.stage('decode', column='sexo') as inner:
+            data = list(range(100000))
+            inner.rows = len(data)
+        record.rows = len(data)
+    record_stage(stats, 'download', 0.5, bytes=10)
+    with stage(None, 'parse') as record:
+        record.rows = 1
+
+    assert [record.name for record in finished] == ['decode', 'parse', 'download']
+    assert finished[1].peak_memory >= finished[0].peak_memory > 0
+    assert finished[1].seconds >= finished[0].seconds
+
+    summary = stats.summary()
+    assert summary.loc['download', 'bytes'] == 10
+    assert summary.loc['parse', 'rows'] == 100000
+    assert stats.to_frame()['column'].tolist()[0] == 'sexo'
+
+
+def test_memory_without_reset_peak(monkeypatch):
+    # Python < 3.9 has no tracemalloc.reset_peak
+    monkeypatch.delattr('tracemalloc.reset_peak')
+    stats = PipelineStats(track_memory=True)
+
+    with stats.stage('parse') as record:
+        data = list(range(100000))
+
+    assert len(data) and record.peak_memory > 0
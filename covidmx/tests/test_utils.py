@@ -0,0 +1,128 @@
+import pytest
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from covidmx.downloader import MIN_SEGMENT_SIZE
+import pandas as pd
+from covidmx.utils import download_file, filter_mask, read_table, write_table
+from covidmx.utils import iter_csv_arrow, read_csv_arrow
+from server import validators
+
+CONTENT = os.urandom(2 * MIN_SEGMENT_SIZE + 1000)
+
+
+@pytest.fixture
+def server(file_server):
+    directory, base, requests_log = file_server
+    (directory / 'file.zip').write_bytes(CONTENT)
+    etag, _ = validators(directory / 'file.zip')
+
+    return base + 'file.zip', etag, requests_log
+
+
+def test_conditional_download(server, tmp_path):
+    url, etag, requests_log = server
+    first = download_file(tmp_path, url)
+    mtime = first.stat().st_mtime_ns
+    second = download_file(tmp_path, url)
+
+    assert first.read_bytes() == CONTENT
+    assert second.stat().st_mtime_ns == mtime
+    assert requests_log[1]['If-None-Match'] == etag
+    assert json.loads((tmp_path / 'file.zip.json').read_text())['complete']
+
+
+def test_resumes_partial_download(server, tmp_path):
+    url, etag, requests_log = server
+    (tmp_path / 'file.zip.part').write_bytes(CONTENT[:1000])
+    (tmp_path / 'file.zip.json').write_text(json.dumps({
+        'url': url, 'etag': etag, 'last_modified': None, 'complete': False
+    }))
+
+    filepath = download_file(tmp_path, url)
+
+    assert requests_log[0]['Range'] == 'bytes=1000-'
+    assert filepath.read_bytes() == CONTENT
+    assert not (tmp_path / 'file.zip.part').exists()
+
+
+def test_parallel_segments(server, tmp_path):
+    url, _, requests_log = server
+    checksum = hashlib.sha256(CONTENT).hexdigest()
+
+    filepath = download_file(tmp_path, url, segments=2, checksum=checksum)
+
+    ranges = [log['Range'] for log in requests_log if 'Range' in log]
+    assert len(ranges) == 2
+    assert filepath.read_bytes() == CONTENT
+    assert json.loads((tmp_path / 'file.zip.json').read_text())['sha256'] == checksum
+
+
+def test_checksum_mismatch(server, tmp_path):
+    url, _, _ = server
+    with pytest.raises(RuntimeError):
+        download_file(tmp_path, url, checksum='0' * 64)
+
+    assert not (tmp_path / 'file.zip').exists()
+
+
+def test_concurrent_download(server, tmp_path):
+    url, _, requests_log = server
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        files = list(executor.map(lambda _: download_file(tmp_path, url), range(4)))
+
+    assert len(requests_log) == 1
+    assert all(filepath.read_bytes() == CONTENT for filepath in files)
+
+
+@pytest.mark.parametrize('cache_format', ['parquet', 'csv'])
+def test_read_table_pushdown(tmp_path, cache_format):
+    df = pd.DataFrame({
+        'entidad_res': pd.Categorical(['JALISCO', 'MORELOS', 'JALISCO']),
+        'fecha_sintomas': pd.to_datetime(['2020-04-01', '2020-04-02', '2020-04-03']),
+        'edad': [30, 40, 50]
+    })
+    path = tmp_path / ('data.' + cache_format)
+    write_table(df, path, cache_format)
+
+    filters = [('entidad_res', '==', 'JALISCO'), ('fecha_sintomas', '>=', pd.Timestamp('2020-04-02'))]
+    selected = read_table(path, cache_format, columns=['edad'], filters=filters)
+
+    assert selected.columns.tolist() == ['edad']
+    assert selected['edad'].tolist() == [50]
+    assert filter_mask(df, [('edad', 'in', [30, 40])]).tolist() == [True, True, False]
+
+
+def test_arrow_csv(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    df = pd.DataFrame({
+        'FECHA_SINTOMAS': ['2020-04-01', '9999-99-99'] * 50,
+        'SEXO': [1, 2] * 50,
+        'PAIS_ORIGEN': ['97', ''] * 50
+    })
+    df.to_csv(tmp_path / 'data.csv', index=False)
+
+    column_types = {'FECHA_SINTOMAS': pa.string(), 'SEXO': pa.int64(), 'PAIS_ORIGEN': pa.string()}
+    table = read_csv_arrow(tmp_path / 'data.csv', column_types=column_types)
+    assert table.schema.field('FECHA_SINTOMAS').type == pa.string()
+    assert table['PAIS_ORIGEN'].null_count == 50
+
+    chunks = list(iter_csv_arrow(tmp_path / 'data.csv', 30, usecols=['SEXO']))
+    assert [len(chunk) for chunk in chunks] == [30, 30, 30, 10]
+    assert pa.concat_tables(chunks)['SEXO'].to_pylist() == df['SEXO'].tolist()
+
+
+@pytest.mark.parametrize('cache_format', ['parquet', 'feather'])
+def test_cache_keeps_dtypes(tmp_path, cache_format):
+    pytest.importorskip('pyarrow')
+    df = pd.DataFrame({
+        'sexo': pd.Categorical(['MUJER', 'HOMBRE', None], categories=['MUJER', 'HOMBRE', 'NO ESPECIFICADO']),
+        'fecha_sintomas': pd.to_datetime(['2020-04-01', None, '2020-04-03']),
+        'municipio_res_original': [14001, 9002, 14001],
+        'edad': [30, 40, 50]
+    })
+    path = tmp_path / ('data.' + cache_format)
+    write_table(df, path, cache_format)
+
+    pd.testing.assert_frame_equal(read_table(path, cache_format), df)
@@ -2,21 +2,40 @@
 # coding: utf-8
 
 from pathlib import Path
-from typing import Tuple, Union
+from typing import IO, Iterable, List, Optional, Tuple, Union
+import json
 import logging
+import os
+import tempfile
+import time
 
-import requests
+import pandas as pd
 import zipfile
 import subprocess
-from tqdm import tqdm
+
+from covidmx.downloader import MIN_SEGMENT_SIZE
+from covidmx.downloader import copy_stream, fetch_segments, file_checksum, get_session, log_throughput
+from covidmx.locking import FileLock, atomic_path
+from covidmx.stats import record_stage, stage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def download_file(directory: Union[str, Path], source_url: str, decompress: bool = False) -> None:
+def download_file(directory: Union[str, Path], source_url: str,
+                  decompress: bool = False, segments: int = 1,
+                  checksum: Optional[str] = None, stats=None) -> Union[Path, List[Path]]:
     """Download data from source_ulr inside directory.
 
+    Requests are conditional (ETag/Last-Modified) when the file was
+    already downloaded, and interrupted downloads are resumed with
+    HTTP Range requests. Validators are stored in a sidecar file
+    (filename + '.json') next to the downloaded file.
+
+    Concurrent calls (threads or processes) sharing directory are
+    serialized by a lock on the file: one of them downloads it and
+    the rest wait and use the published file without a new request.
+
     Parameters
     ----------
     directory: str, Path
@@ -25,44 +44,590 @@ def download_file(directory: Union[str, Path], source_url: str, decompress: bool
         URL where data is hosted.
     decompress: bool
         Wheter decompress downloaded file. Default False.
+    segments: int
+        Number of parallel range requests used to download large files
+        when the server supports them. Default 1.
+    checksum: str
+        Expected sha256 hex digest of the file. Optional.
+    stats: PipelineStats
+        Records download and decompress stages. Optional.
+
+    Returns
+    -------
+    Path of the downloaded file or list of extracted
+    files if decompress.
     """
     if isinstance(directory, str):
         directory = Path(directory)
     directory.mkdir(parents=True, exist_ok=True)
 
+    filename = source_url.split('/')[-1]
+    with FileLock(directory / filename) as lock:
+        return _download_file(directory, source_url, decompress, segments,
+                              checksum, stats, published=lock.waited)
+
+
+def _download_file(directory: Path, source_url: str, decompress: bool = False,
+                   segments: int = 1, checksum: Optional[str] = None, stats=None,
+                   published: bool = False) -> Union[Path, List[Path]]:
+    """Downloads source_url inside directory holding its lock (see download_file).
+    If published, a complete local file (just written by the previous holder
+    of the lock) is used without requesting it again.
+    """
     filename = source_url.split('/')[-1]
     filepath = directory / filename
+    partpath = directory / (filename + '.part')
+    metapath = directory / (filename + '.json')
+
+    metadata = read_metadata(metapath)
+    if metadata.get('url') != source_url:
+        metadata = {}
 
+    headers = {}
+    resume_from = 0
+    complete = metadata.get('complete') and filepath.exists() \
+        and filepath.stat().st_size == metadata.get('size')
+    if complete and published:
+        logger.info(f'{filename} downloaded by another process, using local file.')
+        return _publish(directory, filepath, decompress, False, stats)
+    elif complete:
+        headers.update(conditional_headers(metadata))
+    elif not metadata.get('complete') and partpath.exists():
+        validator = metadata.get('etag') or metadata.get('last_modified')
+        if validator is not None:
+            resume_from = partpath.stat().st_size
+            headers['Range'] = f'bytes={resume_from}-'
+            headers['If-Range'] = validator
+
+    requested = time.perf_counter()
     # Streaming, so we can iterate over the response.
-    r = requests.get(source_url, stream=True)
-    # Total size in bytes.
-    total_size = int(r.headers.get('content-length', 0))
-    block_size = 1024 #1 Kibibyte
+    r = get_session().get(source_url, headers=headers, stream=True)
+
+    if r.status_code == 304:
+        r.close()
+        logger.info(f'{filename} not modified, using local file.')
+        modified = False
+        n_bytes = 0
+    elif r.status_code == 416:
+        # The partial file cannot be resumed, start over.
+        r.close()
+        partpath.unlink()
+        write_metadata(metapath, {})
+        return _download_file(directory, source_url, decompress, segments, checksum, stats)
+    else:
+        r.raise_for_status()
+        if r.status_code != 206:
+            resume_from = 0
+        else:
+            logger.info(f'Resuming download of {filename} from byte {resume_from}.')
+
+        metadata = {
+            'url': source_url,
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'complete': False
+        }
+        write_metadata(metapath, metadata)
+
+        # Total size in bytes.
+        total_size = resume_from + int(r.headers.get('content-length', 0))
+        validator = metadata['etag'] or metadata['last_modified']
+        parallel = segments > 1 and not resume_from \
+            and r.headers.get('Accept-Ranges') == 'bytes' \
+            and total_size >= 2 * MIN_SEGMENT_SIZE
+
+        from tqdm import tqdm
+        t = tqdm(total=total_size, initial=resume_from, unit='iB', unit_scale=True)
+        start = time.perf_counter()
+        if parallel:
+            r.close()
+            try:
+                n_bytes = fetch_segments(source_url, partpath, total_size,
+                                         segments, validator, t)
+            except BaseException:
+                # Segments leave holes in the file, it cannot be resumed.
+                partpath.unlink()
+                write_metadata(metapath, {})
+                raise
+        else:
+            with r, open(partpath, 'ab' if resume_from else 'wb') as f:
+                n_bytes = copy_stream(r.raw, f, t)
+        t.close()
+        throughput = log_throughput(filename, n_bytes, time.perf_counter() - start)
 
-    t = tqdm(total=total_size, unit='iB', unit_scale=True)
-    with open(filepath, 'wb') as f:
-        for data in r.iter_content(block_size):
-            t.update(len(data))
-            f.write(data)
-    t.close()
+        size = partpath.stat().st_size
+        if total_size != resume_from and size != total_size:
+            logger.error('ERROR, something went wrong downloading data')
+            raise RuntimeError(f'Incomplete download of {filename}, it will be resumed on the next call.')
 
-    if total_size != 0 and t.n != total_size:
-        logger.error('ERROR, something went wrong downloading data')
+        sha256 = file_checksum(partpath)
+        if checksum is not None and sha256 != checksum.lower():
+            partpath.unlink()
+            write_metadata(metapath, {})
+            raise RuntimeError(f'Checksum mismatch for {filename}.')
 
-    size = filepath.stat().st_size
-    logger.info(f'Successfully downloaded {filename}, {size}, bytes.')
+        partpath.replace(filepath)
+        metadata.update({
+            'size': size,
+            'sha256': sha256,
+            'throughput': throughput,
+            'complete': True
+        })
+        write_metadata(metapath, metadata)
+        logger.info(f'Successfully downloaded {filename}, {size}, bytes.')
+        modified = True
 
+    record_stage(stats, 'download', time.perf_counter() - requested,
+                 bytes=n_bytes, file=filename)
+
+    return _publish(directory, filepath, decompress, modified, stats)
+
+
+def _publish(directory: Path, filepath: Path, decompress: bool,
+             modified: bool, stats=None) -> Union[Path, List[Path]]:
+    """Returns filepath, or the files extracted from it if decompress.
+    Files are extracted if filepath was modified or some are missing.
+    """
     if decompress:
         with zipfile.ZipFile(filepath, 'r') as zip_ref:
             extracted = zip_ref.namelist()
-            zip_ref.extractall(directory)
-        
+            missing = [file for file in extracted if not (directory / file).exists()]
+            if modified or missing:
+                with stage(stats, 'decompress', file=filepath.name) as record:
+                    extract_atomic(zip_ref, directory)
+                    record.bytes = sum(info.file_size for info in zip_ref.infolist())
+                logger.info(f'Successfully decompressed {filepath}')
+
         extracted = [directory / file for file in extracted]
 
-        logger.info(f'Successfully decompressed {filepath}')
-        
         return extracted
 
+    return filepath
+
+
+def extract_atomic(zip_ref: zipfile.ZipFile, directory: Path) -> None:
+    """Extracts every file of zip_ref inside directory. Files are extracted
+    to a temporary directory first and renamed into place, so readers of
+    previously extracted files never see partially written ones.
+    """
+    with tempfile.TemporaryDirectory(dir=directory, prefix='.extract-') as tmp_dir:
+        zip_ref.extractall(tmp_dir)
+        for info in zip_ref.infolist():
+            target = directory / info.filename
+            if info.is_dir():
+                target.mkdir(parents=True, exist_ok=True)
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(Path(tmp_dir) / info.filename, target)
+
+
+def conditional_headers(metadata: dict) -> dict:
+    """Returns If-None-Match/If-Modified-Since headers from
+    validators stored in metadata.
+    """
+    headers = {}
+    if metadata.get('etag'):
+        headers['If-None-Match'] = metadata['etag']
+    if metadata.get('last_modified'):
+        headers['If-Modified-Since'] = metadata['last_modified']
+
+    return headers
+
+
+def read_metadata(path: Path) -> dict:
+    """Reads a download sidecar file. Returns an empty
+    dict if it does not exist or it is corrupted.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_metadata(path: Path, metadata: dict) -> None:
+    """Writes a download sidecar file atomically."""
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f)
+
+
+class ZipMember:
+    """File inside a zip archive that can be read
+    (several times) without extracting it.
+
+    Parameters
+    ----------
+    archive: str, Path
+        Zip file.
+    name: str
+        Name of the member inside archive.
+    """
+
+    def __init__(self, archive: Union[str, Path], name: str):
+        self.archive = Path(archive)
+        self.name = name
+
+    def open(self) -> IO[bytes]:
+        """Returns a binary stream decompressing the member on the fly."""
+        # The archive stays open until the returned stream is closed.
+        with zipfile.ZipFile(self.archive, 'r') as zip_ref:
+            return zip_ref.open(self.name)
+
+    @property
+    def size(self) -> int:
+        """Uncompressed size of the member in bytes."""
+        with zipfile.ZipFile(self.archive, 'r') as zip_ref:
+            return zip_ref.getinfo(self.name).file_size
+
+    def __str__(self) -> str:
+        return f'{self.archive}/{self.name}'
+
+    def __repr__(self) -> str:
+        return f'ZipMember({str(self.archive)!r}, {self.name!r})'
+
+
+def zip_members(archive: Union[str, Path]) -> List[ZipMember]:
+    """Returns the files (not directories) inside archive."""
+    with zipfile.ZipFile(archive, 'r') as zip_ref:
+        names = [info.filename for info in zip_ref.infolist() if not info.is_dir()]
+
+    return [ZipMember(archive, name) for name in names]
+
+
+def get_size(source: Union[str, Path, ZipMember]) -> int:
+    """Returns the (uncompressed) size in bytes of a local file or a zip member."""
+    if isinstance(source, ZipMember):
+        return source.size
+
+    return Path(source).stat().st_size
+
+
+def open_source(source: Union[str, Path, ZipMember]) -> IO[bytes]:
+    """Opens a local file or a zip member as a binary stream."""
+    if isinstance(source, ZipMember):
+        return source.open()
+
+    return open(source, 'rb')
+
+
+CACHE_EXTENSIONS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'csv': '.csv'
+}
+
+
+def resolve_cache_format(cache_format: str) -> str:
+    """Validates cache_format, falling back to csv
+    when pyarrow is not available for columnar formats.
+
+    Parameters
+    ----------
+    cache_format: str
+        One of parquet, feather, csv.
+    """
+    assert cache_format in CACHE_EXTENSIONS, \
+        'Please provide some of the following cache formats: {}'.format(', '.join(CACHE_EXTENSIONS))
+
+    if cache_format != 'csv':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.warning(f'pyarrow is not installed, {cache_format} cache not available. Using csv.')
+            cache_format = 'csv'
+
+    return cache_format
+
+
+PARSERS = ['pandas', 'pyarrow']
+
+
+def resolve_parser(parser: str) -> str:
+    """Validates parser, falling back to pandas
+    when pyarrow is not available.
+
+    Parameters
+    ----------
+    parser: str
+        One of pandas, pyarrow.
+    """
+    assert parser in PARSERS, \
+        'Please provide some of the following parsers: {}'.format(', '.join(PARSERS))
+
+    if parser == 'pyarrow':
+        try:
+            import pyarrow.csv  # noqa: F401
+        except ImportError:
+            logger.warning('pyarrow is not installed, pyarrow parser not available. Using pandas.')
+            parser = 'pandas'
+
+    return parser
+
+
+def arrow_csv_options(encoding: str = 'UTF-8', usecols: Optional[List[str]] = None,
+                      column_types: Optional[dict] = None) -> dict:
+    """Returns keyword arguments of pyarrow.csv readers. Empty strings
+    are read as nulls, like pandas.read_csv does.
+    """
+    from pyarrow import csv
+
+    return {
+        'read_options': csv.ReadOptions(encoding=encoding, use_threads=True),
+        'convert_options': csv.ConvertOptions(column_types=column_types,
+                                              include_columns=usecols,
+                                              strings_can_be_null=True)
+    }
+
+
+def read_csv_arrow(source: Union[str, Path, ZipMember], encoding: str = 'UTF-8',
+                   usecols: Optional[List[str]] = None,
+                   column_types: Optional[dict] = None):
+    """Reads the csv in source with the multi-threaded
+    pyarrow reader. Returns a pyarrow.Table.
+
+    Parameters
+    ----------
+    source: str, Path, ZipMember
+        Csv file.
+    encoding: str
+        Encoding of the file.
+    usecols: list
+        Only read these columns. Default None (all columns).
+    column_types: dict
+        Column name to pyarrow type. Other columns are inferred.
+    """
+    from pyarrow import csv
+
+    with open_source(source) as f:
+        return csv.read_csv(f, **arrow_csv_options(encoding, usecols, column_types))
+
+
+def iter_csv_arrow(source: Union[str, Path, ZipMember], chunksize: int,
+                   encoding: str = 'UTF-8', usecols: Optional[List[str]] = None,
+                   column_types: Optional[dict] = None):
+    """Yields pyarrow.Tables of chunksize rows (the last one may
+    be smaller) read from the csv in source. See read_csv_arrow.
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+
+    with open_source(source) as f:
+        reader = csv.open_csv(f, **arrow_csv_options(encoding, usecols, column_types))
+        batches = []
+        n_rows = 0
+        for batch in reader:
+            batches.append(batch)
+            n_rows += batch.num_rows
+            while n_rows >= chunksize:
+                table = pa.Table.from_batches(batches, schema=reader.schema)
+                yield table.slice(0, chunksize)
+                batches = table.slice(chunksize).to_batches()
+                n_rows -= chunksize
+
+        if n_rows:
+            yield pa.Table.from_batches(batches, schema=reader.schema)
+
+
+def write_table(df: pd.DataFrame, path: Union[str, Path], cache_format: str = 'parquet') -> None:
+    """Writes df to path using cache_format. The file is written
+    next to path and renamed into place (see atomic_path).
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Data to store.
+    path: str, Path
+        Destination file.
+    cache_format: str
+        One of parquet, feather, csv.
+    """
+    with atomic_path(path) as tmp_path:
+        if cache_format == 'parquet':
+            df.to_parquet(tmp_path, index=False)
+        elif cache_format == 'feather':
+            df.reset_index(drop=True).to_feather(tmp_path)
+        else:
+            df.to_csv(tmp_path, index=False)
+
+
+def write_chunks(chunks: Iterable[pd.DataFrame], path: Union[str, Path], cache_format: str = 'parquet') -> int:
+    """Writes an iterable of DataFrames with the same columns to path.
+    Parquet and csv chunks are appended as they arrive; feather chunks
+    are kept as arrow tables and written at the end since the
+    format needs a single dictionary per categorical column. Path
+    is only replaced once every chunk has been written.
+
+    Parameters
+    ----------
+    chunks: iterable
+        DataFrames to store.
+    path: str, Path
+        Destination file.
+    cache_format: str
+        One of parquet, feather, csv.
+
+    Returns
+    -------
+    Number of rows written.
+    """
+    with atomic_path(path) as tmp_path:
+        return _write_chunks(chunks, tmp_path, cache_format)
+
+
+def _write_chunks(chunks: Iterable[pd.DataFrame], path: Path, cache_format: str) -> int:
+    n_rows = 0
+
+    if cache_format == 'csv':
+        with open(path, 'w', newline='') as f:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(f, index=False, header=i == 0)
+                n_rows += len(chunk)
+
+        return n_rows
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = None
+    writer = None
+    tables = []
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if schema is None:
+                schema = table.schema
+            else:
+                table = table.cast(schema)
+
+            if cache_format == 'parquet':
+                if writer is None:
+                    writer = pq.ParquetWriter(path, schema)
+                writer.write_table(table)
+            else:
+                tables.append(table)
+            n_rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if tables:
+        table = pa.concat_tables(tables).unify_dictionaries().combine_chunks()
+        import pyarrow.feather as feather
+        feather.write_feather(table, path)
+
+    return n_rows
+
+
+def concat_frames(frames: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenates frames keeping categorical columns as categoricals.
+    Categories are unioned in order of appearance.
+    """
+    frames = [frame.copy(deep=False) for frame in frames]
+    categories = {}
+    for frame in frames:
+        for col, dtype in frame.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype):
+                categories.setdefault(col, {}).update(dict.fromkeys(dtype.categories))
+
+    for col, cats in categories.items():
+        dtype = pd.CategoricalDtype(list(cats))
+        for frame in frames:
+            if col in frame:
+                frame[col] = frame[col].astype(dtype)
+
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def read_table(path: Union[str, Path], cache_format: str = 'parquet',
+               columns: Optional[List[str]] = None,
+               filters: Optional[List[Tuple]] = None) -> pd.DataFrame:
+    """Reads a table written by write_table.
+
+    Parameters
+    ----------
+    path: str, Path
+        File to read.
+    cache_format: str
+        One of parquet, feather, csv.
+    columns: list
+        Only read these columns. Default None (all columns).
+    filters: list
+        Only read rows matching every (column, op, value) filter.
+        See filter_mask. Pushed down to the reader for parquet.
+    """
+    if cache_format == 'parquet':
+        return pd.read_parquet(path, columns=columns, filters=filters or None)
+
+    read_cols = columns
+    if columns is not None and filters:
+        read_cols = list(dict.fromkeys(list(columns) + [col for col, _, _ in filters]))
+
+    if cache_format == 'feather':
+        df = pd.read_feather(path, columns=read_cols)
+    else:
+        df = pd.read_csv(path, usecols=read_cols)
+
+    if filters:
+        df = df[filter_mask(df, filters)].reset_index(drop=True)
+    if columns is not None:
+        df = df[columns]
+
+    return df
+
+
+FILTER_OPS = {
+    '==': lambda s, v: s == v,
+    '=': lambda s, v: s == v,
+    '!=': lambda s, v: s != v,
+    '<': lambda s, v: s < v,
+    '<=': lambda s, v: s <= v,
+    '>': lambda s, v: s > v,
+    '>=': lambda s, v: s >= v,
+    'in': lambda s, v: s.isin(v),
+    'not in': lambda s, v: ~s.isin(v)
+}
+
+
+def filter_mask(df: pd.DataFrame, filters: List[Tuple]) -> pd.Series:
+    """Returns a boolean mask of the rows of df matching every filter.
+
+    Parameters
+    ----------
+    df: pd.DataFrame
+        Data to filter.
+    filters: list
+        (column, op, value) tuples as used by pyarrow; op is one of
+        ==, !=, <, <=, >, >=, in, not in. Datetime columns
+        are compared with pd.to_datetime(value).
+    """
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in filters:
+        assert op in FILTER_OPS, 'Please provide some of the following operators: {}'.format(', '.join(FILTER_OPS))
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            value = pd.to_datetime(value)
+        elif isinstance(value, pd.Timestamp) or \
+                (op in ('in', 'not in') and any(isinstance(v, pd.Timestamp) for v in value)):
+            series = pd.to_datetime(series, errors='coerce')
+        mask &= FILTER_OPS[op](series, value).fillna(False).astype(bool)
+
+    return mask
+
+
+def read_table_columns(path: Union[str, Path], cache_format: str = 'parquet') -> List[str]:
+    """Returns column names of a table written by write_table
+    without loading its data.
+    """
+    if cache_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    elif cache_format == 'feather':
+        import pyarrow.ipc as ipc
+        return ipc.open_file(path).schema.names
+
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
 
 translate_serendipia = {
     'confirmed': 'positivos',
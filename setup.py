@@ -18,17 +18,22 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.5',
+    python_requires='>=3.7',
     install_requires = [
         "more-itertools>=6.0.0",
-        "pandas>=0.25.2",
+        "pandas>=1.1.0",
+        "pyarrow>=1.0.0",
         "Unidecode>=1.1.1",
         "requests>=2.21.0",
         "xlrd>=1.2.0",
+        "openpyxl>=3.0.0",
         "mapsmx>=0.0.3",
         "matplotlib>=3.0.3",
         "mapclassify>=2.2.0",
         "descartes>=1.1.0",
         "wget>=1.0"
-    ]
+    ],
+    extras_require={
+        "test": ["pytest"]
+    }
 )